@@ -0,0 +1,172 @@
+import os
+import json
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from time import time
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def file_key(filename, st=None):
+    """ (absolute path, size, mtime) of a file, which changes when the file is modified. """
+    if st is None:
+        st = os.stat(filename)
+    return os.path.abspath(filename), st.st_size, st.st_mtime
+
+
+def array_key(*arrays):
+    """ Fingerprint of the shapes, dtypes and contents of arrays. """
+    h = hashlib.sha1()
+    for a in arrays:
+        a = np.ascontiguousarray(a)
+        h.update(('%s%s' % (a.dtype.str, a.shape)).encode('ascii'))
+        h.update(a)
+    return h.hexdigest()
+
+
+class MemoryCache:
+    """
+    In-memory LRU cache which holds at most max_size (MB) of values. Every value is
+    stored with its size in bytes. It can be used from several threads.
+    """
+
+    def __init__(self, max_size=1000):
+        self.max_size = max_size * 1e6
+        self.items = OrderedDict()# {key: (value, nbytes)}, least recently used first
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.items
+
+    def get(self, key):
+        """ Return the value of key or None, and count the hit or miss. """
+        with self.lock:
+            if key not in self.items:
+                self.misses += 1
+                return None
+            self.hits += 1
+            value, nbytes = self.items.pop(key)
+            self.items[key] = (value, nbytes)
+            return value
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+            self.nbytes = 0
+
+    def put(self, key, value, nbytes):
+        """ Store a value, then evict the least recently used ones. """
+        with self.lock:
+            if key in self.items:
+                self.nbytes -= self.items.pop(key)[1]
+            if nbytes > self.max_size:
+                return
+            self.items[key] = (value, nbytes)
+            self.nbytes += nbytes
+            while self.nbytes > self.max_size:
+                _, (_, n) = self.items.popitem(last=False)
+                self.nbytes -= n
+
+
+class ParseCache:
+    """
+    On-disk cache of parsed text data files.
+
+    Every entry is a Fortran ordered .npy file, so that the columns can be
+    memory-mapped individually, and a .json file with the parse state. Entries
+    are keyed on the absolute path, size and mtime of the source file. The least
+    recently used entries are removed when the total size exceeds max_size (MB).
+    """
+    MIN_FILE_SIZE = 1e6  # bytes, smaller files are parsed fast enough
+    MIN_FILE_AGE = 10  # seconds, younger files are probably still being written
+
+    def __init__(self, directory, max_size=1000):
+        self.directory = directory
+        self.max_size = max_size * 1e6
+        if self.max_size > 0 and not os.path.exists(directory):
+            os.makedirs(directory)
+
+    def get_key(self, filename):
+        st = os.stat(filename)
+        s = '%s|%d|%r' % file_key(filename, st)
+        return hashlib.sha1(s.encode('utf-8')).hexdigest(), st
+
+    def get(self, filename):
+        """ Return (memory-mapped data, parsed bytes, columns) or None if not cached. """
+        if self.max_size <= 0:
+            return None
+        try:
+            key, _ = self.get_key(filename)
+            path = os.path.join(self.directory, key)
+            if not os.path.exists(path + '.json'):
+                return None
+            with open(path + '.json') as f:
+                meta = json.load(f)
+            data = np.load(path + '.npy', mmap_mode='r')
+            now = time()
+            os.utime(path + '.json', (now, now))  # mark as recently used
+            logger.info('ParseCache: hit %s' % filename)
+            columns = meta.get('columns')
+            if columns is None:
+                columns = list(range(data.shape[1]))
+            return data, meta['parsed_bytes'], columns
+        except Exception as e:
+            logger.warning('ParseCache: Failed to read cache of %s: %s' % (filename, e))
+            return None
+
+    def put(self, filename, data, parsed_bytes, columns):
+        """ Store the parsed data (columns of the file) of a file, then evict old entries. """
+        if self.max_size <= 0 or data.nbytes > self.max_size:
+            return
+        try:
+            key, st = self.get_key(filename)
+            if st.st_size < self.MIN_FILE_SIZE or time() - st.st_mtime < self.MIN_FILE_AGE:
+                return
+            path = os.path.join(self.directory, key)
+            tmp = path + '.tmp.npy'
+            mm = np.lib.format.open_memmap(tmp, mode='w+', dtype=data.dtype,
+                                           shape=data.shape, fortran_order=True)
+            mm[:] = data
+            del mm
+            os.rename(tmp, path + '.npy')
+            with open(path + '.json', 'w') as f:
+                json.dump({'filename': os.path.abspath(filename),
+                           'parsed_bytes': parsed_bytes,
+                           'columns': [int(j) for j in columns]}, f)
+        except Exception as e:
+            logger.warning('ParseCache: Failed to cache %s: %s' % (filename, e))
+        self.evict()
+
+    def evict(self):
+        """ Remove the least recently used entries until the cache fits in max_size. """
+        entries = []
+        total = 0
+        for name in os.listdir(self.directory):
+            if not name.endswith('.json'):
+                continue
+            key = name[:-5]
+            path = os.path.join(self.directory, key)
+            try:
+                size = os.path.getsize(path + '.npy') + os.path.getsize(path + '.json')
+                entries.append((os.path.getmtime(path + '.json'), size, path))
+                total += size
+            except OSError:
+                pass
+        for _, size, path in sorted(entries):
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(path + '.npy')
+                os.remove(path + '.json')
+                total -= size
+            except OSError as e:
+                # Probably still memory-mapped (Windows), try again next time
+                logger.info('ParseCache: Could not remove %s: %s' % (path, e))
@@ -6,7 +6,8 @@ from vispy import gloo, scene
 from vispy.util.transforms import ortho, translate
 
 from .colormap import Colormap
-from .util import eng_format
+from .data import RECTILINEAR_TOLERANCE
+from .util import eng_format, get_next_filename
 
 logger = logging.getLogger(__name__)
 
@@ -90,6 +91,89 @@ void main()
 }
 """
 
+# Vertex and fragment shader to draw data on an evenly spaced grid as a
+# single quad, the values are looked up in a float texture
+grid_vert = """
+attribute vec2 a_position;
+attribute vec2 a_texcoord;
+
+uniform mat4 u_view;
+uniform mat4 u_projection;
+
+varying vec2 v_texcoord;
+
+void main()
+{
+    gl_Position = u_projection * u_view * vec4(a_position, 0.0, 1.0);
+    v_texcoord = a_texcoord;
+}
+"""
+
+grid_frag = """
+uniform float z_min;
+uniform float z_max;
+uniform sampler1D u_colormap;
+uniform sampler2D u_values;
+
+varying vec2 v_texcoord;
+
+void main()
+{
+    float value = texture2D(u_values, v_texcoord).r;
+
+    // NaN is not equal to itself, leave these points blank
+    if (value != value)
+        discard;
+
+    float normalized = clamp((value-z_min)/(z_max-z_min), 0.0, 1.0);
+    gl_FragColor = texture1D(u_colormap, normalized);
+}
+"""
+
+
+# Vertex and fragment shader to draw the quads of a warped grid as a mesh of
+# shared corner vertices. The corner indices, interpolated over a quad, floor
+# to the index of its datapoint, whose value is looked up in a float texture
+mesh_vert = """
+attribute vec2 a_position;
+attribute vec2 a_index;
+
+uniform mat4 u_view;
+uniform mat4 u_projection;
+
+varying vec2 v_index;
+
+void main()
+{
+    gl_Position = u_projection * u_view * vec4(a_position, 0.0, 1.0);
+    v_index = a_index;
+}
+"""
+
+mesh_frag = """
+uniform float z_min;
+uniform float z_max;
+uniform sampler1D u_colormap;
+uniform sampler2D u_values;
+// Number of columns and rows of the values
+uniform vec2 u_shape;
+
+varying vec2 v_index;
+
+void main()
+{
+    vec2 index = clamp(floor(v_index), vec2(0.0, 0.0), u_shape - 1.0);
+    float value = texture2D(u_values, (index + 0.5) / u_shape).r;
+
+    // NaN is not equal to itself, leave these points blank
+    if (value != value)
+        discard;
+
+    float normalized = clamp((value-z_min)/(z_max-z_min), 0.0, 1.0);
+    gl_FragColor = texture1D(u_colormap, normalized);
+}
+"""
+
 
 class Canvas(scene.SceneCanvas):
     """
@@ -98,6 +182,11 @@ class Canvas(scene.SceneCanvas):
     A data point is drawn using two triangles to form a quad,
     it is colored by using the normalized data value and a
     colormap texture in the fragment shader.
+
+    Data on an evenly spaced rectilinear grid is uploaded as a float
+    texture instead and drawn as a single quad. Other data that fits in
+    a texture is drawn as an indexed mesh of the quad corners, with the
+    values in a texture.
     """
 
     def __init__(self, parent=None):
@@ -107,8 +196,22 @@ class Canvas(scene.SceneCanvas):
         self.has_redrawn = True
 
         self.data = None
-        self.data_changed = False
         self.data_program = gloo.Program(data_vert, data_frag)
+        self.grid_program = gloo.Program(grid_vert, grid_frag)
+        self.mesh_program = gloo.Program(mesh_vert, mesh_frag)
+        # How the data is drawn: 'grid', 'mesh' or 'triangles'
+        self.mode = None
+        self.programs = {'grid': self.grid_program,
+                         'mesh': self.mesh_program,
+                         'triangles': self.data_program}
+        self.max_texture_size = None
+        # x and y of the data whose geometry is uploaded
+        self.coords = None
+        # Index of the uploaded part of z
+        self.values_index = None
+        # The colors of the colormap texture, see get_colormap_texture
+        self.cmap_colors = None
+        self.cmap_texture = None
 
         path = os.path.dirname(os.path.realpath(__file__))
         path = os.path.join(path, 'colormaps'+os.path.sep+'transform'+os.path.sep+'Seismic.npy')
@@ -130,15 +233,31 @@ class Canvas(scene.SceneCanvas):
         gloo.set_clear_color((1, 1, 1, 1))
 
     def set_data(self, data):
+        if self.update_values(data):
+            self.data = data
+            self.update()
+
+            return
+
         self.data = data
-        self.data_changed = True
+        self.coords = None
 
-        vertices = self.generate_vertices(data)
+        grid = self.generate_grid(data)
+        mesh = self.generate_mesh(data) if grid is None else None
 
-        self.xmin = np.nanmin(vertices['a_position'][:, 0])
-        self.xmax = np.nanmax(vertices['a_position'][:, 0])
-        self.ymin = np.nanmin(vertices['a_position'][:, 1])
-        self.ymax = np.nanmax(vertices['a_position'][:, 1])
+        if grid is not None:
+            (self.xmin, self.xmax, self.ymin, self.ymax), self.values_index = grid
+        else:
+            if mesh is not None:
+                vertices, indices = mesh
+            else:
+                vertices = self.generate_vertices(data)
+            self.values_index = (slice(None), slice(None))
+
+            self.xmin = np.nanmin(vertices['a_position'][:, 0])
+            self.xmax = np.nanmax(vertices['a_position'][:, 0])
+            self.ymin = np.nanmin(vertices['a_position'][:, 1])
+            self.ymax = np.nanmax(vertices['a_position'][:, 1])
 
         if self.xmin == self.xmax or self.ymin == self.ymax:
             logger.error(('Cannot plot because min and max values of'
@@ -155,12 +274,47 @@ class Canvas(scene.SceneCanvas):
         self.projection = ortho(self.xmin, self.xmax + self.cm_dx,
                                 self.ymin, self.ymax, -1, 1)
 
-        self.data_program['u_view'] = self.view
-        self.data_program['u_projection'] = self.projection
+        cmap_texture = self.get_colormap_texture()
 
-        cmap_texture = gloo.Texture1D(self.colormap.get_colors(),
-                                      interpolation='linear')
-        self.data_program['u_colormap'] = cmap_texture
+        if grid is not None:
+            self.mode = 'grid'
+        elif mesh is not None:
+            self.mode = 'mesh'
+        else:
+            self.mode = 'triangles'
+
+        program = self.programs[self.mode]
+        program['u_view'] = self.view
+        program['u_projection'] = self.projection
+        program['u_colormap'] = cmap_texture
+
+        values = self.get_values(data)
+
+        if self.mode == 'triangles':
+            # Repeat the values six times for every six vertices required
+            # by the two datapoint triangles
+            self.values_vbo = gloo.VertexBuffer(np.repeat(values.ravel(), 6)[:, np.newaxis])
+            self.vbo = gloo.VertexBuffer(vertices)
+            program.bind(self.vbo)
+            program['a_value'] = self.values_vbo
+        else:
+            # Every texel is one datapoint, colored without interpolation
+            self.values_texture = gloo.Texture2D(values, interpolation='nearest',
+                                                 internalformat='r32f')
+            program['u_values'] = self.values_texture
+
+        if self.mode == 'grid':
+            program['a_position'] = [(self.xmin, self.ymin),
+                                     (self.xmin, self.ymax),
+                                     (self.xmax, self.ymin),
+                                     (self.xmax, self.ymax)]
+            program['a_texcoord'] = [(0, 0), (0, 1), (1, 0), (1, 1)]
+        elif self.mode == 'mesh':
+            program['u_shape'] = (values.shape[1], values.shape[0])
+
+            self.vbo = gloo.VertexBuffer(vertices)
+            self.ibo = gloo.IndexBuffer(indices)
+            program.bind(self.vbo)
 
         self.colorbar_program['u_view'] = self.view
         self.colorbar_program['u_projection'] = self.projection
@@ -168,11 +322,130 @@ class Canvas(scene.SceneCanvas):
         self.linecut_program['u_view'] = self.view
         self.linecut_program['u_projection'] = self.projection
 
-        self.vbo = gloo.VertexBuffer(vertices)
-        self.data_program.bind(self.vbo)
+        self.coords = data.x, data.y
 
         self.update()
 
+    def get_values(self, data):
+        """ The values to upload, as float32 """
+        return np.ascontiguousarray(data.z[self.values_index], dtype=np.float32)
+
+    def update_values(self, data):
+        """
+        If data has the x and y arrays of the data whose geometry is uploaded,
+        upload only its values into the existing buffer or texture and return
+        True. The arrays of a Data2D are copied before they are modified
+        (Data2D.own), so the same arrays have the same coordinates.
+        """
+        if (self.coords is None or data.x is not self.coords[0] or
+                data.y is not self.coords[1] or data.z.shape != self.data.z.shape):
+            return False
+
+        values = self.get_values(data)
+
+        if self.mode == 'triangles':
+            self.values_vbo.set_data(np.repeat(values.ravel(), 6)[:, np.newaxis])
+        else:
+            self.values_texture.set_data(values)
+
+        return True
+
+    def get_colormap_texture(self):
+        """
+        The texture of the colormap colors. It is uploaded again only when the
+        colors change, which are cached by the Colormap until its gamma changes.
+        """
+        colors = self.colormap.get_colors()
+
+        if colors is not self.cmap_colors:
+            if self.cmap_texture is not None and self.cmap_colors.shape == colors.shape:
+                self.cmap_texture.set_data(colors)
+            else:
+                self.cmap_texture = gloo.Texture1D(colors, interpolation='linear')
+            self.cmap_colors = colors
+
+        return self.cmap_texture
+
+    def get_max_texture_size(self):
+        """ GL_MAX_TEXTURE_SIZE of the OpenGL context, queried once """
+        if self.max_texture_size is None:
+            try:
+                self.set_current()
+                self.max_texture_size = int(gloo.gl.glGetParameter(gloo.gl.GL_MAX_TEXTURE_SIZE))
+            except Exception as e:
+                logger.warning('Could not query the maximum texture size: %s' % e)
+                # Supported by practically every OpenGL 2 implementation
+                self.max_texture_size = 2048
+
+        return self.max_texture_size
+
+    def generate_grid(self, data):
+        """
+        If the data is on an evenly spaced rectilinear grid that fits in a
+        texture, return the (xmin, xmax, ymin, ymax) edges of the quad to
+        draw and the index of the values of the texture in z. Otherwise
+        return None.
+        """
+        grid = data.get_grid()
+        if grid is None:
+            return None
+
+        x, y, rows, columns = grid
+        max_size = self.get_max_texture_size()
+        if len(x) > max_size or len(y) > max_size:
+            return None
+
+        # Every column/row needs to be within the tolerance of its position
+        # on the quad, else the datapoints are drawn at the wrong place
+        dx = (x[-1] - x[0]) / (len(x) - 1)
+        dy = (y[-1] - y[0]) / (len(y) - 1)
+        if (np.abs(x - np.linspace(x[0], x[-1], len(x))).max() > RECTILINEAR_TOLERANCE * dx or
+                np.abs(y - np.linspace(y[0], y[-1], len(y))).max() > RECTILINEAR_TOLERANCE * dy):
+            return None
+
+        # The datapoints are in the centers of the texels
+        edges = (x[0] - dx / 2, x[-1] + dx / 2, y[0] - dy / 2, y[-1] + dy / 2)
+
+        return edges, (rows, columns)
+
+    def generate_mesh(self, data):
+        """
+        Generate the vertices of the corners shared by the dataset
+        quadrilaterals and the indices of a triangle strip over the quads.
+        Return None if the values don't fit in a texture.
+        """
+        rows, columns = data.z.shape
+        max_size = self.get_max_texture_size()
+        if rows > max_size or columns > max_size:
+            return None
+
+        xq, yq = data.get_quadrilaterals(data.x, data.y)
+
+        dtype = [('a_position', np.float32, 2), ('a_index', np.float32, 2)]
+        vertex_data = np.zeros(xq.size, dtype=dtype)
+        vertex_data['a_position'][:, 0] = xq.ravel()
+        vertex_data['a_position'][:, 1] = yq.ravel()
+
+        # The (column, row) index of every corner
+        column_index, row_index = np.meshgrid(np.arange(columns + 1),
+                                              np.arange(rows + 1))
+        vertex_data['a_index'][:, 0] = column_index.ravel()
+        vertex_data['a_index'][:, 1] = row_index.ravel()
+
+        corners = np.arange(xq.size, dtype=np.uint32).reshape(xq.shape)
+
+        # A triangle strip zigzags between the top and bottom corners of a row
+        # of quads, giving the same two triangles per datapoint as
+        # generate_vertices. The rows are joined by degenerate triangles.
+        strips = np.empty((rows, 2 * columns + 4), dtype=np.uint32)
+        strips[:, 1:-2:2] = corners[:-1]
+        strips[:, 2:-1:2] = corners[1:]
+        strips[:, 0] = strips[:, 1]
+        strips[:, -1] = strips[:, -2]
+        indices = strips.ravel()
+
+        return vertex_data, indices
+
     def generate_vertices(self, data):
         """ Generate vertices for the dataset quadrilaterals """
         xq, yq = data.get_quadrilaterals(data.x, data.y)
@@ -201,14 +474,11 @@ class Canvas(scene.SceneCanvas):
         total_vertices = len(x1) * 6
         vertices = xy.reshape((total_vertices, 2))
 
-        dtype = [('a_position', np.float32, 2), ('a_value', np.float32, 1)]
+        # The values are in a separate buffer, see set_data
+        dtype = [('a_position', np.float32, 2)]
         vertex_data = np.zeros(total_vertices, dtype=dtype)
         vertex_data['a_position'] = vertices
 
-        # Repeat the values six times for every six vertices required
-        # by the two datapoint triangles
-        vertex_data['a_value'] = np.repeat(data.z.ravel(), 6, axis=0)
-
         return vertex_data
 
     def screen_to_data_coords(self, pos):
@@ -269,7 +539,7 @@ class Canvas(scene.SceneCanvas):
         self.mouse_end = (self.xmax, self.line_coord)
         # Get the data row
         x, y, row_numbers, index = self.data.get_row_at(y)
-        z = '%.3e'%np.nanmean(self.data.y[index, :])
+        z = '%.3e'%self.data.y_means[index]
 
         x_name, y_name, data_name, title = self.parent.export_widget.get_format_axis_names()
         self.parent.linecut.plot_linetrace(x, y, z, row_numbers, self.line_type,
@@ -290,7 +560,7 @@ class Canvas(scene.SceneCanvas):
 
         # Get the data column
         x, y, row_numbers, index = self.data.get_column_at(x)
-        z = '%.3e'%np.nanmean(self.data.x[:, index])
+        z = '%.3e'%self.data.x_means[index]
 
         x_name, y_name, data_name, title = self.parent.export_widget.get_format_axis_names()
         self.parent.linecut.plot_linetrace(x, y, z, row_numbers, self.line_type,
@@ -321,11 +591,12 @@ class Canvas(scene.SceneCanvas):
             y_points = np.linspace(y_start, y, 500)
             z = '[%.3e,%.3e]->[%.3e,%.3e]'%(x_start,y_start,x,y)
 
-            if self.data_changed:
-                self.data.generate_triangulation()
-                self.data_changed = False
-
-            vals = self.data.interpolate(np.column_stack((x_points, y_points)))
+            if not self.data.interpolation_ready():
+                # Triangulating takes long, the linecut is drawn again when it is done
+                self.parent.triangulate(self.data)
+                vals = np.full(len(x_points), np.nan)
+            else:
+                vals = self.data.interpolate(np.column_stack((x_points, y_points)))
 
             # Create data for the x-axis using hypotenuse
             dist = np.hypot(x_points - x_points[0], y_points - y_points[0])
@@ -357,19 +628,10 @@ class Canvas(scene.SceneCanvas):
             self.loadNext(self.parent.abs_filename)
             
     def loadNext(self,currentFilePath,inc=1):
-        if currentFilePath and currentFilePath.endswith('.dat'):
-            _ = currentFilePath[:-4]
-            for i in range(len(_)-1,-1,-1):
-                if not _[i:].isdigit():
-                    break
-            if i == 0:
-                i = -1
-            if i != len(_)-1:
-                fileCount = int(_[i+1:])+inc
-                _ = _[:i+1]+str(fileCount)+'.dat'
-                if os.path.isfile(_):
-                    self.parent.le_path.setText(_)
-                    self.parent.load_dat_file(_)
+        _ = get_next_filename(currentFilePath, inc)
+        if _ is not None and os.path.isfile(_):
+            self.parent.le_path.setText(_)
+            self.parent.load_dat_file(_)
 
     def on_mouse_move(self, event):
         if self.data is not None:
@@ -398,14 +660,19 @@ class Canvas(scene.SceneCanvas):
 
         if self.data is not None:
             # Draw first the data, then colormap, and then linecut
-            cmap_texture = gloo.Texture1D(self.colormap.get_colors(),
-                                          interpolation='linear')
+            cmap_texture = self.get_colormap_texture()
 
             # Drawing of the plot
-            self.data_program['u_colormap'] = cmap_texture
-            self.data_program['z_min'] = self.colormap.min
-            self.data_program['z_max'] = self.colormap.max
-            self.data_program.draw('triangles')
+            program = self.programs[self.mode]
+            program['u_colormap'] = cmap_texture
+            program['z_min'] = self.colormap.min
+            program['z_max'] = self.colormap.max
+            if self.mode == 'grid':
+                program.draw('triangle_strip')
+            elif self.mode == 'mesh':
+                program.draw('triangle_strip', self.ibo)
+            else:
+                program.draw('triangles')
 
             # Drawing of the colormap bar
             self.colorbar_program['u_colormap'] = cmap_texture
@@ -423,5 +690,6 @@ class Canvas(scene.SceneCanvas):
         self.has_redrawn = True
     def clear(self):
         self.data=None
+        self.coords=None
         gloo.clear()
         self.update()
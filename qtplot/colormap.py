@@ -13,6 +13,8 @@ class Colormap:
         self.colors = np.loadtxt(path)
         self.gamma = 1
         self.min, self.max = 0, 1
+        # (gamma, colors) of the last get_colors
+        self.lut = None
 
         self.length = self.colors.shape[0]
 
@@ -26,7 +28,12 @@ class Colormap:
 
         This array can be uploaded to the GPU in vispy/opengl as a
         1D texture to be used as a lookup table for coloring the data.
+
+        The array is cached until the gamma changes, don't modify it.
         """
+        if self.lut is not None and self.lut[0] == self.gamma:
+            return self.lut[1]
+
         x = np.linspace(0, 1, self.length)
         y = x**self.gamma
 
@@ -35,7 +42,11 @@ class Colormap:
         g = np.interp(y, value, self.colors[:,1])
         b = np.interp(y, value, self.colors[:,2])
 
-        return np.dstack((r, g, b)).reshape(len(r), 3).astype(np.uint8)
+        colors = np.dstack((r, g, b)).reshape(len(r), 3).astype(np.uint8)
+        colors.flags.writeable = False
+        self.lut = self.gamma, colors
+
+        return colors
 
     def get_mpl_colormap(self):
         """
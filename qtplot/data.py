@@ -1,18 +1,26 @@
 import os
+import copy
 import logging
+import threading
 from collections import OrderedDict
 import mmap
 import numpy as np
 import math
-from scipy import ndimage, interpolate, io
+from scipy import io
 from scipy.spatial import qhull
-from pandas.io.api import read_table
 import pandas as pd
 
-from .util import FixedOrderFormatter, eng_format
+from .util import FixedOrderFormatter, eng_format, interp_rows
+from . import parser
+from . import filters
+from .cache import file_key, array_key, MemoryCache
 
 logger = logging.getLogger(__name__)
 
+ELEMENTWISE_BLOCK_SIZE = 1 << 15  # values per block of fused elementwise operations
+
+RECTILINEAR_TOLERANCE = 0.1  # deviation of the coordinates from their row/column means, in grid steps
+
 
 class DatFile:
     """ Class which contains the column based DataFrame of the data. """
@@ -25,41 +33,285 @@ class DatFile:
         self.shape = []#(size1,size2,...)
         self.ndim = 0
         self.qtlab_settings = OrderedDict()
-        self.data = None
+        self.data = None# 2D array of the parsed (or memory-mapped) columns
+        self.data_columns = []# indices in self.ids of the columns of self.data
+        self.columns = OrderedDict()# {index in self.ids: 1D array}, lazily parsed and derived columns
+        self.n_file_columns = 0
+        self.usecols = None# indices of the columns to parse on load, None for all
+        self.progress = None# callback(parsed bytes, total bytes, rows) while loading
+        self.version = 0# incremented when the data changes
         self.main = main
         self.a3_sp = ''#setpoint of axis 3, the axis perpendicular to screen
-    
-    def update_file(self, filename):
+        # For text files: the byte offset up to which complete lines have been parsed
+        # and the last parsed line, used to detect truncated or rewritten files.
+        self.parsed_bytes = 0
+        self.parsed_tail = b''
+        # Row offsets of the pages and lines, see build_page_index()
+        self.page_offsets = None
+        self.line_offsets = None
+        # (key, a3_sp, Data2D) of the last get_data
+        self.last_slice = None
+
+    def update_file(self, filename, progress=None):
+        """
+        Load a new file or refresh the current one. progress(parsed bytes, total bytes, rows)
+        is called while parsing and may raise parser.LoadCancelled to stop.
+        """
         if self.filename != filename:
-            logger.info('Loading a new file: %s' %filename)
             if self.data is not None:
                 del self.data
             self.__init__(self.main)
+            if self.load_dataset_cache(filename):
+                return True#new file
+            logger.info('Loading a new file: %s' %filename)
+            key = file_key(filename) if os.path.exists(filename) else None
             self.filename = filename
-            self.load_qtlab_settings()# load .set file
-            self.load_metadata()# load metadata, for .mtx files, data are loaded at this step
-            self.load_data()# load data
+            self.progress = progress
+            try:
+                self.load_qtlab_settings()# load .set file
+                self.load_metadata()# load metadata, for .mtx files, data are loaded at this step
+                self.n_file_columns = len(self.ids)
+                self.usecols = self.get_usecols()
+                is_cached = self.load_cached_data()# memory-map parsed text data if cached
+                self.load_data()# load data
+                if not is_cached:
+                    self.save_cached_data()
+            finally:
+                self.progress = None
+            if self.data is not None and key is not None:
+                self.main.dataset_cache.put(key, self.get_state(), self.get_nbytes())
             return True#new file
         else:
-            self.load_data()# load data
+            self.progress = progress
+            try:
+                self.load_data()# load data
+            finally:
+                self.progress = None
             return False#old file
 
+    def get_state(self):
+        """
+        Everything loaded from the file, for the dataset cache. The arrays are shared,
+        the containers are copied so that set_column doesn't change the cached state.
+        """
+        state = dict(self.__dict__)
+        del state['main'], state['progress'], state['last_slice']
+        self.copy_containers(state)
+        self.share_data()
+        return state
+
+    @staticmethod
+    def copy_containers(state):
+        """ Copy the containers of the columns in state (a __dict__ of a DatFile). """
+        state['ids'] = list(state['ids'])
+        state['labels'] = list(state['labels'])
+        state['data_columns'] = list(state['data_columns'])
+        state['columns'] = OrderedDict(state['columns'])
+
+    def is_in_dataset_cache(self, filename):
+        try:
+            return file_key(filename) in self.main.dataset_cache
+        except OSError:
+            return False
+
+    def load_dataset_cache(self, filename):
+        """ Restore the state of filename from the dataset cache, return False if not cached. """
+        try:
+            state = self.main.dataset_cache.get(file_key(filename))
+        except OSError:
+            return False
+        if state is None:
+            return False
+        logger.info('DatFile: %s from the dataset cache' % filename)
+        state = dict(state)
+        self.copy_containers(state)
+        self.__dict__.update(state)
+        return True
+
+    def get_nbytes(self):
+        """ Memory used by the data, memory-mapped data is not counted. """
+        arrays = [self.data] + list(self.columns.values())
+        return sum(a.nbytes for a in arrays if isinstance(a, np.ndarray) and not isinstance(a, np.memmap))
+
+    def copy(self):
+        """ Copy which can be refreshed without changing this DatFile. The arrays are shared. """
+        self.share_data()
+        new = copy.copy(self)
+        self.copy_containers(new.__dict__)
+        return new
+
+    def share_data(self):
+        """ Make self.data read-only before it is shared, set_column copies it then. """
+        if isinstance(self.data, np.ndarray):
+            self.data.flags.writeable = False
+
     def load_data(self):
         try:
             if self.filename.endswith('.npy'):
                 if self.data is None:
                     self.data = np.load(self.filename, mmap_mode='r')
+                    self.data_columns = list(range(self.n_file_columns))
             elif self.filename.endswith('.mtx'):
-                pass#data is imported in self.load_metadata()
+                self.data_columns = list(range(self.n_file_columns))#data is imported in self.load_metadata()
             else:
-                self.data = read_table(self.filename, comment='#', sep='\t', header=None).values
-            if len(self.data.shape)!=2 or self.data.shape[1]!=len(self.ids):
+                self.load_text_data()
+            if len(self.data.shape)!=2 or self.data.shape[1]!=len(self.data_columns):
                 self.data = None
                 logger.warning('DatFile: Data shape does not match ids. Return None data')
+        except parser.LoadCancelled:
+            raise
         except Exception, e:
             self.data = None
             logger.warning('DatFile: Failed to load data: %s'%e)
-    
+        self.build_page_index()
+        self.version += 1
+
+    def load_text_data(self):
+        """
+        Parse a tab separated text file. If the file only grew since the last call,
+        parse just the newly appended complete lines and append them to self.data.
+        Otherwise (first call, truncated or rewritten file) reload the whole file.
+        """
+        with open(self.filename, 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            if self.data is not None and self.is_appended(f, size):
+                end = self.find_line_end(f, self.parsed_bytes, size)
+                if end == self.parsed_bytes:
+                    return
+                lazy = [j for j in self.columns if j < self.n_file_columns]
+                try:
+                    new_data = self.parse_rows(f, self.parsed_bytes, end, self.data_columns + lazy)
+                except ValueError as e:
+                    logger.info('DatFile: Reload the whole file, appended rows not parsed: %s' % e)
+                else:
+                    self.set_parsed(f, end)
+                    if new_data is not None:
+                        self.append_rows(new_data)
+                    return
+            end = self.find_line_end(f, 0, size)
+            self.data = self.parse_rows(f, 0, end, self.usecols)
+            if self.data is None:
+                raise ValueError('No complete data line')
+            self.data_columns = list(range(self.n_file_columns)) if self.usecols is None else list(self.usecols)
+            self.columns.clear()
+            self.set_parsed(f, end)
+
+    def append_rows(self, new_data):
+        """ Append parsed rows of the columns self.data_columns + lazily parsed columns. """
+        logger.info('DatFile: %d rows appended' % len(new_data))
+        n = len(self.data_columns)
+        self.data = np.vstack((self.data, new_data[:,:n]))
+        lazy = [j for j in self.columns if j < self.n_file_columns]
+        for i, j in enumerate(lazy):
+            self.columns[j] = np.concatenate((self.columns[j], new_data[:,n+i]))
+        # Derived columns (sub series R) are not known for the new rows
+        for j in self.columns:
+            if j >= self.n_file_columns:
+                padding = np.empty(len(new_data))
+                padding.fill(np.nan)
+                self.columns[j] = np.concatenate((self.columns[j], padding))
+
+    def get_usecols(self):
+        """
+        Indices of the columns used by the current profile if only those should be
+        parsed (qtplot.ini: lazy_columns), None to parse all columns.
+        """
+        if not self.main.lazy_columns or not self.is_text_file():
+            return None
+        names = self.main.get_used_parameters(self.ids)
+        if names is None:
+            return None
+        usecols = sorted(set(self.ids.index(name) for name in names if name in self.ids[:self.n_file_columns]))
+        return usecols if usecols else None
+
+    def load_columns(self, indices):
+        """ Parse columns of a text file which were skipped when loading it. """
+        indices = [j for j in indices if j < self.n_file_columns and j not in self.data_columns and j not in self.columns]
+        if not indices or self.data is None or not self.is_text_file():
+            return
+        logger.info('DatFile: Parse columns %s' % indices)
+        with open(self.filename, 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            if not self.is_appended(f, f.tell()):
+                logger.warning('DatFile: File changed, columns %s not loaded. Refresh first.' % indices)
+                return
+            data = self.parse_rows(f, 0, self.parsed_bytes, indices)
+        if data is None or len(data) != self.data.shape[0]:
+            logger.warning('DatFile: Number of rows changed, columns %s not loaded.' % indices)
+            return
+        for i, j in enumerate(indices):
+            self.columns[j] = data[:,i]
+
+    def is_text_file(self):
+        return not (self.filename.endswith('.npy') or self.filename.endswith('.mtx'))
+
+    def load_cached_data(self):
+        """ Memory-map the parsed data of a text file from the parse cache. """
+        cache = self.main.parse_cache
+        if cache is None or not self.is_text_file() or not os.path.isfile(self.filename):
+            return False
+        cached = cache.get(self.filename)
+        if cached is None:
+            return False
+        self.data, parsed_bytes, self.data_columns = cached
+        with open(self.filename, 'rb') as f:
+            self.set_parsed(f, parsed_bytes)
+        return True
+
+    def save_cached_data(self):
+        cache = self.main.parse_cache
+        if cache is not None and self.data is not None and self.is_text_file():
+            cache.put(self.filename, self.data, self.parsed_bytes, self.data_columns)
+
+    def is_appended(self, f, size):
+        """ Whether the open file f still starts with the part that has been parsed. """
+        if size < self.parsed_bytes:
+            return False
+        n = len(self.parsed_tail)
+        f.seek(self.parsed_bytes - n)
+        return f.read(n) == self.parsed_tail
+
+    def set_parsed(self, f, end):
+        """ Remember that the open file f has been parsed up to byte offset end. """
+        f.seek(max(0, end - 256))
+        self.parsed_tail = f.read(end - f.tell())
+        self.parsed_bytes = end
+
+    def find_line_end(self, f, start, size):
+        """ Return the byte offset after the last complete line between start and size. """
+        end = size
+        while end > start:
+            block_start = max(start, end - 4096)
+            f.seek(block_start)
+            i = f.read(end - block_start).rfind(b'\n')
+            if i >= 0:
+                return block_start + i + 1
+            end = block_start
+        return start
+
+    def parse_rows(self, f, start, end, usecols=None):
+        """
+        Parse the lines between byte offsets start and end of the open file f. Only the
+        columns usecols are returned, in that order. Return None if there is no data line.
+        """
+        if end <= start:
+            return None
+        if end - start >= parser.MIN_PARALLEL_SIZE and self.main.parse_workers != 1:
+            try:
+                return parser.parse_parallel(self.filename, start, end, usecols,
+                                             self.main.parse_workers, self.progress)
+            except parser.ParallelParseError as e:
+                logger.warning('DatFile: Parallel parsing failed, parse in one process: %s' % e)
+        try:
+            data = parser.read_chunks(f, start, end, usecols, self.progress)
+        except ValueError:
+            # Allow blank or comment lines only (e.g. between blocks of a live measurement)
+            if start == 0 or parser.has_data_lines(f, start, end):
+                raise
+            return None
+        return data
+
     def load_metadata(self):
         if self.filename.endswith('.npy'):
             meta_filename = self.filename[:-3]+'meta.txt'# for .npy data
@@ -90,29 +342,22 @@ class DatFile:
             elif first_line.startswith('Units'):#MTX file
                 _ = first_line.split(',') 
                 self.ids = [x.strip() for x in [_[2],_[5],_[8],_[1]]]
-                self.labels = self.ids
+                self.labels = list(self.ids)
                 
                 s_line = f.readline()
                 size_list = s_line.split(' ')
                 self.shape = [int(x) for x in size_list[0:3]]
 
-                x = np.linspace(float(_[3]),float(_[4]),self.shape[0])
-                y = np.linspace(float(_[6]),float(_[7]),self.shape[1])
-                z = np.linspace(float(_[9]),float(_[10]),self.shape[2])
-                z,y,x = np.meshgrid(z,y,x,indexing='ij')
+                ranges = [(float(_[3]),float(_[4])),(float(_[6]),float(_[7])),(float(_[9]),float(_[10]))]
 
                 dtp = np.float64 if int(size_list[3]) == 8 else np.float32
-                w = np.fromfile(f,dtype=dtp).reshape(self.shape)
-                self.data = np.vstack((x.ravel(),y.ravel(),z.ravel(),w.ravel('F'))).T
+                w = np.memmap(self.filename, dtype=dtp, mode='r', offset=f.tell(), shape=tuple(self.shape))
+                self.data = MtxData(w, ranges)
                 
             if len(self.shape)<3:
                 self.shape += [1]*(3-len(self.shape))
 
             self.ndim = sum(d > 1 for d in self.shape)
-            if self.shape[2]>1:
-                self.main.cb_a3.setStyleSheet("background-color:#cfc;")
-            else:
-                self.main.cb_a3.setStyleSheet("background-color:#eee;")      
 
     def load_qtlab_settings(self):
         path, ext = os.path.splitext(self.filename)
@@ -145,31 +390,101 @@ class DatFile:
 
     def get_column(self, name):
         if name in self.ids:
-            return self.data[:, self.ids.index(name)]
+            j = self.ids.index(name)
+            if j in self.data_columns:
+                return self.data[:, self.data_columns.index(j)]
+            if j not in self.columns:
+                self.load_columns([j])
+            return self.columns.get(j)
         else:
             return None
 
+    def get_value(self, row, j):
+        """ Value of column j (index in self.ids) in a row. """
+        if j in self.data_columns:
+            return self.data[int(row), self.data_columns.index(j)]
+        return self.get_column(self.ids[j])[int(row)]
+
     def set_column(self, name, values):
         if name in self.ids:
-            self.data[:, self.ids.index(name)] = values
+            j = self.ids.index(name)
+            if j in self.data_columns:
+                if not isinstance(self.data, np.ndarray) or not self.data.flags.writeable:
+                    self.data = np.array(self.data)# .mtx, memory-mapped or shared (see share_data)
+                self.data[:, self.data_columns.index(j)] = values
+            else:
+                self.columns[j] = values
         else:
             self.ids.append(name)
             self.labels.append(name)
-            self.data = np.hstack((self.data, values[:, np.newaxis]))
+            self.columns[len(self.ids)-1] = values
+        self.version += 1
 
     def get_row_info(self, row):
         # Return a dict of all parameter-value pairs in the row
-        return OrderedDict(zip(self.ids, self.data[row]))
+        self.load_columns(range(len(self.ids)))
+        return OrderedDict((name, self.get_value(row, j)) for j, name in enumerate(self.ids))
     
-    def get_dim(self):
-        a3,_,__ = self.main.get_a3()
+    def get_dim(self, a3=None):
+        if a3 is None:
+            a3,_,__ = self.main.get_a3()
         dim_a3 = 0 if self.shape[a3]<2 else 1
         return self.ndim-dim_a3
 
-    def get_data(self, x_name, y_name, z_name, a3, a3index):
+    def build_page_index(self):
+        """
+        Compute the row offsets of every page (a3 index of the 3rd axis) and of every
+        line within a page, so that get_data only touches the rows of one slice.
+        """
+        if self.data is None or isinstance(self.data, MtxData):
+            self.page_offsets = self.line_offsets = None
+            return
+        n_per_line = self.shape[0]#number per line
+        n_per_page = self.shape[0]*self.shape[1]#number per page
+        n_dp = self.data.shape[0]#number of datapoints
+        n_pg = max(int(np.ceil(float(n_dp)/n_per_page)), 1)#number of pages
+        self.page_offsets = np.arange(n_pg)*n_per_page
+        self.line_offsets = np.arange(self.shape[1])*n_per_line
+
+    def get_slice_rows(self, a3, a3index):
+        """
+        Return a 2D array of the row numbers of slice a3index along axis a3, as laid out
+        on the screen (lines along the first axis). Rows not measured yet are >= len(data).
+        """
+        points = np.arange(self.shape[0])
+        if a3 == 0:#x_ind=const
+            return self.page_offsets[:,np.newaxis] + self.line_offsets[np.newaxis,:] + a3index
+        elif a3 == 1:#y_ind=const
+            return self.page_offsets[:,np.newaxis] + self.line_offsets[a3index] + points[np.newaxis,:]
+        else:#z_ind=const
+            return self.page_offsets[a3index] + self.line_offsets[:,np.newaxis] + points[np.newaxis,:]
+
+    def take_rows(self, column, rows, dtype=np.float64):
+        """
+        Gather column[rows] as floats of dtype, NaN for rows which don't exist (yet).
+        A column of None is taken as zeros.
+        """
+        n_dp = self.data.shape[0]
+        valid = rows < n_dp
+        if column is None:
+            return np.where(valid, 0., np.nan).astype(dtype, copy=False)
+        start = rows.flat[0]
+        if rows.flat[-1] < n_dp and rows.flat[-1] - start == rows.size - 1:
+            # Contiguous rows (a complete page): a view instead of a copy
+            return np.asarray(column[start:start+rows.size], dtype=dtype).reshape(rows.shape)
+        values = np.empty(rows.shape, dtype)
+        values.fill(np.nan)
+        values[valid] = column[rows[valid]]
+        return values
+
+    def get_data(self, x_name, y_name, z_name, a3, a3index, dtype=np.float64):
+        """
+        Return a Data2D of the slice a3index along axis a3. The values z are of dtype
+        (float32 halves the memory of the operations), the coordinates stay float64.
+        """
         if self.data is None:
             return None
-        if self.get_dim()==0:
+        if self.get_dim(a3)==0:
             logger.error('0 dimensional data!')
             return None
         if x_name == '':
@@ -178,88 +493,286 @@ class DatFile:
         if a3index > self.shape[a3]-1:
             logger.error('axis3 index out of range.')
             return None
-        if y_name != '' and self.get_dim()==1:
+        if y_name != '' and self.get_dim(a3)==1:
             logger.warning('Ignoring the y-axis parameter since it is a 1D dataset')
             y_name = ''
         
-        n_per_line = self.shape[0]#number per line
-        n_per_page = self.shape[0]*self.shape[1]#number per page
-        n_dp = self.data.shape[0]#number of datapoints
-        n_pg = np.ceil(float(n_dp)/n_per_page)#number of pages
-        
-        
-        pivot = np.empty((4,n_per_page*n_pg))*np.nan#pad with na.nan
-
-        row_numbers = np.arange(n_dp)#n_dp also == len(x_data)
-        x_data = self.get_column(x_name)
-        y_data = self.get_column(y_name)
-        z_data = self.get_column(z_name)
-        if y_data is None:
-            y_data = np.zeros(n_dp)
-
-        pivot[0,:n_dp] = x_data
-        pivot[1,:n_dp] = y_data
-        pivot[2,:n_dp] = z_data
-        pivot[3,:n_dp] = row_numbers
-        pivot = pivot.reshape([4,n_pg]+self.shape[1::-1])
+        if a3 == -1:
+            a3 = 2
+        if a3 not in (0, 1, 2):
+            return None
 
-        if a3 == 0:#x_ind=const
-            x,y,z,row_numbers = pivot[:,:,:,a3index]
-        elif a3 == 1:#y_ind=const
-            x,y,z,row_numbers = pivot[:,:,a3index,:]
-        elif a3 == 2 or a3==-1:#z_ind=const
-            x,y,z,row_numbers = pivot[:,a3index,:,:]
+        # The same slice is returned with the same arrays, so the results of the
+        # operations keep them if they don't change them (see Canvas.update_values)
+        key = (self.version, x_name, y_name, z_name, a3, a3index, np.dtype(dtype).str)
+        last_slice = self.last_slice
+        if last_slice is not None and last_slice[0] == key:
+            self.a3_sp = last_slice[1]
+            return last_slice[2].copy()
+
+        if isinstance(self.data, MtxData):
+            # Strided views of the memory-mapped values, no pivot of the whole dataset
+            columns = [self.ids.index(name) if name in self.ids else None for name in (x_name, y_name, z_name)]
+            # Columns added by set_column are arrays over the rows of the table
+            columns = [np.asarray(self.get_column(self.ids[j])) if j is not None and j not in self.data_columns else j
+                       for j in columns]
+            x,y,z,row_numbers = self.data.get_slice(columns, a3, a3index)
+            z = np.asarray(z, dtype=dtype)
         else:
-            return None
+            # Only the rows of the requested slice are gathered, missing rows are NaN
+            rows = self.get_slice_rows(a3, a3index)
+            x = self.take_rows(self.get_column(x_name), rows)
+            y = self.take_rows(self.get_column(y_name), rows)
+            z = self.take_rows(self.get_column(z_name), rows, dtype)
+            row_numbers = np.where(rows < self.data.shape[0], rows, np.nan)
 
         a3_name = self.ids[a3].split('_')[-1][1:-1]
         if a3_name:
-            self.a3_sp = '%s: %s'%(a3_name,self.data[row_numbers[0,0],a3])
+            self.a3_sp = '%s: %s'%(a3_name,self.get_value(row_numbers[0,0],a3))
         else:
             self.a3_sp = ''
         
-        # Remove NaN rows
+        # Remove NaN rows, if there are any (else keep the views)
         nans = np.isnan(row_numbers[:,0])
-        x = x[~nans]
-        y = y[~nans]
-        z = z[~nans]
-        row_numbers = row_numbers[~nans]
+        if nans.any():
+            x = x[~nans]
+            y = y[~nans]
+            z = z[~nans]
+            row_numbers = row_numbers[~nans]
         
         # If 1d, remove NaN elements
-        if len(row_numbers)==1:
+        if len(row_numbers)==1 and np.isnan(row_numbers[0]).any():
             nans = np.isnan(row_numbers[0])
             x = x[:,~nans]
             y = y[:,~nans]
             z = z[:,~nans]
             row_numbers = row_numbers[:,~nans]
         
-        return Data2D(x, y, z, row_numbers, x_name, y_name, z_name, self.filename, self.timestamp, self)
+        data = Data2D(x, y, z, row_numbers, x_name, y_name, z_name, self.filename, self.timestamp, self)
+        self.last_slice = key, self.a3_sp, data
+        return data.copy()
 
 
-def create_kernel(x_dev, y_dev, cutoff, distr):
-    distributions = {
-        'gaussian': lambda r: np.exp(-(r**2) / 2.0),
-        'exponential': lambda r: np.exp(-abs(r) * np.sqrt(2.0)),
-        'lorentzian': lambda r: 1.0 / (r**2+1.0),
-        'thermal': lambda r: np.exp(r) / (1 * (1+np.exp(r))**2)
-    }
-    func = distributions[distr]
+class MtxData:
+    """
+    Lazy version of the N x 4 (x, y, z, value) table of a Spyview .mtx file.
 
-    hx = np.floor((x_dev * cutoff) / 2.0)
-    hy = np.floor((y_dev * cutoff) / 2.0)
+    The values are memory-mapped with shape (nx, ny, nz) and the coordinates
+    are described by their linspace parameters, so nothing is read from disk
+    until a slice is requested.
+    """
 
-    x = np.linspace(-hx, hx, hx * 2 + 1) / x_dev
-    y = np.linspace(-hy, hy, hy * 2 + 1) / y_dev
+    def __init__(self, values, ranges):
+        self.values = values
+        self.ranges = ranges# [(start, end)] of x, y and z
+        self.grid_shape = values.shape
+        self.strides = (1, self.grid_shape[0], self.grid_shape[0]*self.grid_shape[1])# in rows of the table
+        self.shape = (values.size, 4)
+
+    def get_axis(self, i):
+        start, end = self.ranges[i]
+        return np.linspace(start, end, self.grid_shape[i])
+
+    def get_row(self, row):
+        index = np.unravel_index(int(row), self.grid_shape, order='F')
+        coords = [self.get_axis(i)[index[i]] for i in range(3)]
+        return np.array(coords + [self.values[index]])
+
+    def get_column(self, col):
+        nx, ny, nz = self.grid_shape
+        if col == 0:
+            return np.tile(self.get_axis(0), ny*nz)
+        elif col == 1:
+            return np.tile(np.repeat(self.get_axis(1), nx), nz)
+        elif col == 2:
+            return np.repeat(self.get_axis(2), nx*ny)
+        else:
+            return self.values.ravel('F')
 
-    if x.size == 1: x = np.zeros(1)
-    if y.size == 1: y = np.zeros(1)
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            return self.get_row(key)
+        row, col = key
+        if isinstance(row, slice):
+            return self.get_column(col)[row]
+        return self.get_row(row)[col]
 
-    xv, yv = np.meshgrid(x, y)
+    def __array__(self, dtype=None):
+        a = np.column_stack([self.get_column(i) for i in range(4)])
+        return a if dtype is None else a.astype(dtype)
 
-    kernel = func(np.sqrt(xv**2+yv**2))
-    kernel /= np.sum(kernel)
+    def get_slice(self, columns, a3, a3index):
+        """
+        Return the (x, y, z, row_numbers) arrays of the 2D slice a3index along grid axis a3,
+        with the row (slow) axis first, as DatFile.get_data does. columns are the table
+        column indices of x, y and z, or 1D arrays of values for every row of the table
+        (derived columns). A column of None is filled with zeros.
+        """
+        lo, hi = [i for i in range(3) if i != a3]# fast and slow axes of the slice
+        n_lo, n_hi = self.grid_shape[lo], self.grid_shape[hi]
+
+        s = self.strides
+        row_numbers = (a3index*s[a3] + np.arange(n_lo)[np.newaxis,:]*s[lo] +
+                       np.arange(n_hi)[:,np.newaxis]*s[hi])
+
+        arrays = []
+        for col in columns:
+            if isinstance(col, np.ndarray):
+                a = col[row_numbers]
+            elif col is None:
+                a = np.zeros((n_hi, n_lo))
+            elif col == 3:
+                index = [slice(None)] * 3
+                index[a3] = a3index
+                a = self.values[tuple(index)].T# basic slicing: a view of the memory map
+            elif col == a3:
+                a = np.broadcast_to(self.get_axis(col)[a3index], (n_hi, n_lo))
+            elif col == lo:
+                a = np.broadcast_to(self.get_axis(col)[np.newaxis,:], (n_hi, n_lo))
+            else:
+                a = np.broadcast_to(self.get_axis(col)[:,np.newaxis], (n_hi, n_lo))
+            arrays.append(a)
 
-    return kernel
+        return arrays + [row_numbers.astype(float)]
+
+
+def elementwise_steps(func, kwargs):
+    """
+    Express the Data2D operation func(**kwargs) as a list of in-place elementwise
+    steps [(array name, step)], where step(a) modifies a block of the array a like
+    the operation does. A step of None subtracts the minimum of the whole array.
+    Return None if the operation is not elementwise.
+    """
+    name = func.__name__
+    steps = []
+    if name == 'abs':
+        steps.append(('z', lambda a: np.absolute(a, out=a)))
+    elif name == 'negate':
+        steps.append(('z', lambda a: np.multiply(a, -1, out=a)))
+    elif name in ('offset', 'scale', 'power'):
+        ufunc, unit = {'offset': (np.add, 0), 'scale': (np.multiply, 1), 'power': (np.power, 1)}[name]
+        for axis in 'xyz':
+            value = kwargs.get('%s_%s' % (axis, name), unit)
+            if value != unit:
+                steps.append((axis, lambda a, v=value: ufunc(a, v, out=a)))
+    elif name == 'log':
+        steps += [(axis, lambda a: np.log10(a, out=a)) for axis in 'xyz' if kwargs[axis]]
+    elif name == 'sub_min':
+        steps += [(axis, None) for axis in 'xyz' if kwargs[axis]]
+    elif name == 'R_in_R2':
+        R2 = 12906.4
+        Amp = kwargs['a_V']/kwargs['a_I']
+        Rin = kwargs['Rin']
+        def step(a):
+            np.multiply(a, Amp, out=a)
+            np.subtract(a, Rin, out=a)
+            np.divide(a, R2, out=a)
+        steps.append(('z', step))
+    elif name == 'G_in_G2':
+        G2 = 7.74809e-5
+        Amp = kwargs['a_I']/kwargs['a_V']
+        Rin = kwargs['Rin']
+        def step(a):
+            np.multiply(a, Amp, out=a)
+            t = np.multiply(a, Rin)
+            np.subtract(1, t, out=t)
+            np.divide(a, t, out=a)
+            np.divide(a, G2, out=a)
+        steps.append(('z', step))
+    else:
+        return None
+    return steps
+
+
+def histogram_columns(z, min, max, bins, block_size=1 << 16):
+    """
+    np.histogram(z[:,j], bins, (min, max))[0] of every column j of z, as the columns
+    of a (bins, columns) array. The bin indices are computed like np.histogram does
+    and counted at once by bincount, offset by column. Rows are processed in blocks
+    of about block_size values to limit the memory use.
+    """
+    edges = np.histogram(z[:0,0], bins, (min, max))[1]# checks the range like np.histogram
+    if min == max:
+        min, max = min - 0.5, max + 0.5
+    norm = np.subtract(max, min)
+    cols = z.shape[1]
+    hist = np.zeros(bins * cols, np.intp)
+    step = int(np.ceil(block_size / float(cols or 1)))
+    offsets = np.arange(cols) * bins
+    for i in range(0, z.shape[0], step):
+        block = z[i:i+step]
+        keep = (block >= min) & (block <= max)
+        if keep.all():
+            a = block.ravel().astype(edges.dtype, copy=False)
+            columns = np.broadcast_to(offsets, block.shape).ravel()
+        else:
+            a = block[keep].astype(edges.dtype, copy=False)
+            columns = offsets[np.nonzero(keep)[1]]
+        indices = ((a - min) / norm * bins).astype(np.intp)
+        indices[indices == bins] -= 1
+        # Correct the values within ~1 ULP of the bin edges
+        indices[a < edges[indices]] -= 1
+        indices[(a >= edges[indices + 1]) & (indices != bins - 1)] += 1
+        indices += columns
+        hist += np.bincount(indices, minlength=bins * cols)
+    return hist.reshape(cols, bins).T
+
+
+class ArrayStats:
+    """
+    Statistics of an array which are computed once: min and max ignoring NaN, the
+    number of NaN, percentiles and histograms. The array must not change.
+    """
+
+    def __init__(self, a):
+        self.a = a
+        self.cache = {}
+
+    def get(self, key, func):
+        if key not in self.cache:
+            self.cache[key] = func()
+        return self.cache[key]
+
+    def get_min_max(self):
+        return self.get('min_max', lambda: (np.nanmin(self.a), np.nanmax(self.a)))
+
+    def get_nan_count(self):
+        return self.get('nan_count', lambda: int(np.count_nonzero(np.isnan(self.a))))
+
+    def get_percentile(self, q):
+        return self.get(('percentile', q), lambda: np.nanpercentile(self.a, q))
+
+    def get_histogram(self, bins=256):
+        """ (counts, bin edges) of the values which are not NaN, between min and max. """
+        def histogram():
+            a = self.a[~np.isnan(self.a)] if self.get_nan_count() else self.a
+            return np.histogram(a, bins, self.get_min_max() if a.size else None)
+        return self.get(('histogram', bins), histogram)
+
+
+class SortedIndex:
+    """ Lookup of the value closest to a coordinate in O(log n). NaN are skipped. """
+
+    def __init__(self, values):
+        finite = np.flatnonzero(~np.isnan(values))
+        self.order = finite[np.argsort(values[finite], kind='mergesort')]
+        self.sorted = values[self.order]
+
+    def nearest(self, value):
+        """ Index of the value closest to value, the first one of equally close ones. """
+        n = len(self.sorted)
+        if n == 0:
+            return 0
+        i = np.searchsorted(self.sorted, value)
+        best = None
+        for j in (i - 1, i):
+            if 0 <= j < n:
+                # The first of equal values has the lowest index, the sort is stable
+                j = np.searchsorted(self.sorted, self.sorted[j])
+                key = (abs(self.sorted[j] - value), self.order[j])
+                if best is None or key < best:
+                    best = key
+        return int(best[1])
 
 
 class Data2D:
@@ -267,6 +780,10 @@ class Data2D:
     Class which represents 2d data as two matrices with x and y coordinates
     and one with values.
     """
+    # Delaunay triangulations, keyed on the coordinates (see generate_triangulation),
+    # replaced by QTPlot with the triangulation_cache_size of qtplot.ini
+    triangulations = MemoryCache(500)
+
     def __init__(self, x, y, z, row_numbers=[],
                  x_name='', y_name='', z_name='',
                  filename='', timestamp='', dat_file=None):
@@ -309,11 +826,10 @@ class Data2D:
 
         self.x, self.y, self.z = x, y, z
         self.row_numbers = row_numbers                              
+        self.owned = {}# {name: array} of the arrays copied by own()
         self.tri = None
-
-        # Store column and row averages for linetrace lookup
-        self.x_means = np.nanmean(self.x, axis=0)
-        self.y_means = np.nanmean(self.y, axis=1)
+        self.tri_lock = threading.Lock()
+        self.derived = {}# {name: (source arrays, value)} of get_derived
         
     def get_scan_dir_symbol(self,a,is_inner_loop):
         if len(a)==1:
@@ -385,10 +901,14 @@ class Data2D:
     def set_data(self, x, y, z):
         self.x, self.y, self.z = x, y, z
 
+    def get_stats(self, name='z'):
+        """ ArrayStats of the array name ('x', 'y' or 'z'), computed again when it changes. """
+        return self.get_derived(name + '_stats', (getattr(self, name),), ArrayStats)
+
     def get_limits(self):
-        xmin, xmax = np.nanmin(self.x), np.nanmax(self.x)
-        ymin, ymax = np.nanmin(self.y), np.nanmax(self.y)
-        zmin, zmax = np.nanmin(self.z), np.nanmax(self.z)
+        xmin, xmax = self.get_stats('x').get_min_max()
+        ymin, ymax = self.get_stats('y').get_min_max()
+        zmin, zmax = self.get_stats('z').get_min_max()
 
         # Thickness for 1d scans, should we do this here or
         # in the drawing code?
@@ -413,32 +933,138 @@ class Data2D:
 
         return x, y
 
-    def generate_triangulation(self):
-        xc = self.x.ravel()
-        yc = self.y.ravel()
-        zc = self.z.ravel()
-
-        # Remove any NaN values as the triangulation can't handle this
-        nans = np.isnan(zc)
-        xc = xc[~nans]
-        yc = yc[~nans]
-        self.no_nan_values = zc[~nans]
-
-        # Normalize the coordinates. This improves the triangulation results
-        # in cases where the data ranges on both axes are very different
-        # in magnitude
-        xmin, xmax, ymin, ymax, _, _ = self.get_limits()
-        xc = (xc - xmin) / (xmax - xmin)
-        yc = (yc - ymin) / (ymax - ymin)
+    def generate_triangulation(self, cached_only=False):
+        """
+        Triangulate the coordinates of the values which are not NaN. This only depends
+        on x, y and the NaN of z, so the triangulation is cached on a fingerprint of
+        them and reused after operations which only change the values. With
+        cached_only, don't triangulate or wait for another thread triangulating if it
+        is not cached. Return whether self.tri is set.
+        """
+        if not self.tri_lock.acquire(not cached_only):
+            return False
+        try:
+            xc = self.x.ravel()
+            yc = self.y.ravel()
+            zc = self.z.ravel()
+
+            # Remove any NaN values as the triangulation can't handle this
+            nans = self.get_nans()
+            key = self.get_triangulation_key()
+            tri = self.triangulations.get(key)
+            if tri is None:
+                if cached_only:
+                    return False
+                xc = xc[~nans]
+                yc = yc[~nans]
+
+                # Normalize the coordinates. This improves the triangulation results
+                # in cases where the data ranges on both axes are very different
+                # in magnitude
+                xmin, xmax, ymin, ymax, _, _ = self.get_limits()
+                xc = (xc - xmin) / (xmax - xmin)
+                yc = (yc - ymin) / (ymax - ymin)
+
+                tri = qhull.Delaunay(np.column_stack((xc, yc)))
+                nbytes = sum(a.nbytes for a in (tri.points, tri.simplices, tri.neighbors, tri.transform))
+                self.triangulations.put(key, tri, nbytes)
+
+            self.no_nan_values = zc[~nans]
+            self.tri = tri
+            return True
+        finally:
+            self.tri_lock.release()
+
+    def get_nans(self):
+        """ Whether the values of z.ravel() are NaN. """
+        return self.get_derived('nans', (self.z,), lambda z: np.isnan(z.ravel()))
+
+    def get_triangulation_key(self):
+        """ Fingerprint of x, y and the NaN of z. """
+        return self.get_derived('tri_key', (self.x, self.y, self.z), lambda x, y, z: array_key(x, y, self.get_nans()))
+
+    def get_derived(self, name, sources, func):
+        """
+        Return func(*sources), cached until one of the arrays sources is replaced or
+        owned for a modification in place (see own).
+        """
+        cached = self.derived.get(name)
+        if cached is None or any(a is not b for a, b in zip(sources, cached[0])):
+            cached = sources, func(*sources)
+            self.derived[name] = cached
+        return cached[1]
+
+    @property
+    def x_means(self):
+        """ Averages of the columns of x, for linetrace lookup. """
+        return self.get_derived('x_means', (self.x,), lambda x: np.nanmean(x, axis=0))
+
+    @property
+    def y_means(self):
+        """ Averages of the rows of y, for linetrace lookup. """
+        return self.get_derived('y_means', (self.y,), lambda y: np.nanmean(y, axis=1))
+
+    def get_grid(self):
+        """
+        If the data is on a (nearly) rectilinear grid, every column at about the same
+        x and every row at about the same y, return (x, y, rows, columns): the
+        increasing column and row coordinates and the slices of the data they
+        cover. NaN rows or columns at the edges, like of an unfinished scan, are
+        left out. Otherwise return None.
+        """
+        return self.get_derived('grid', (self.x, self.y), self.find_grid)
+
+    def find_grid(self, x, y):
+        x_means, y_means = self.x_means, self.y_means
+        columns = np.flatnonzero(np.isfinite(x_means))
+        rows = np.flatnonzero(np.isfinite(y_means))
+        if not (len(columns) > 1 and len(rows) > 1 and
+                columns[-1] - columns[0] == len(columns) - 1 and rows[-1] - rows[0] == len(rows) - 1):
+            return None
+        columns = slice(columns[0], columns[-1] + 1)
+        rows = slice(rows[0], rows[-1] + 1)
+        xs, ys = x_means[columns], y_means[rows]
+        dx, dy = np.diff(xs), np.diff(ys)
+        if not ((dx > 0).all() and (dy > 0).all()):
+            return None
+        with np.errstate(invalid='ignore'):
+            x_dev = np.nanmax(np.abs(x[rows, columns] - xs))
+            y_dev = np.nanmax(np.abs(y[rows, columns] - ys[:,np.newaxis]))
+        if x_dev <= RECTILINEAR_TOLERANCE * dx.min() and y_dev <= RECTILINEAR_TOLERANCE * dy.min():
+            return xs, ys, rows, columns
+        return None
+
+    def interpolate_grid(self, points, grid):
+        """ Bilinear interpolation of points on the rectilinear grid of get_grid, NaN outside. """
+        x, y, rows, columns = grid
+        z = self.z[rows, columns]
+        px, py = points[:,0], points[:,1]
+
+        i = np.searchsorted(x, px).clip(1, len(x) - 1)
+        j = np.searchsorted(y, py).clip(1, len(y) - 1)
+        tx = (px - x[i-1]) / (x[i] - x[i-1])
+        ty = (py - y[j-1]) / (y[j] - y[j-1])
+
+        values = ((z[j-1, i-1] * (1 - tx) + z[j-1, i] * tx) * (1 - ty) +
+                  (z[j, i-1] * (1 - tx) + z[j, i] * tx) * ty)
+        values[(px < x[0]) | (px > x[-1]) | (py < y[0]) | (py > y[-1])] = np.nan
+        return values
 
-        self.tri = qhull.Delaunay(np.column_stack((xc, yc)))
+    def interpolation_ready(self):
+        """ Whether interpolate is fast: the grid is rectilinear or the triangulation is cached. """
+        return self.get_grid() is not None or self.tri is not None or self.generate_triangulation(cached_only=True)
 
     def interpolate(self, points):
         """
-        Interpolate points on the 2d data.
+        Interpolate points on the 2d data. Bilinear on a rectilinear grid, else on
+        the Delaunay triangulation.
 
         points: N x 2 numpy array with (x, y) as rows
         """
+        grid = self.get_grid()
+        if grid is not None:
+            return self.interpolate_grid(points, grid)
+
         if self.tri is None:
             self.generate_triangulation()
 
@@ -492,6 +1118,8 @@ class Data2D:
         -   Add a row/column at the end to satisfy the 1 larger
             requirements of pcolor
         """
+        # NaN edges are extrapolated in place, don't change the arrays of the Data2D
+        xc, yc = np.array(xc), np.array(yc)
 
         # If we are dealing with data that is 2-dimensional
         # -2 rows: both coords need non-nan values
@@ -606,20 +1234,20 @@ class Data2D:
         return cb
 
     def get_column_at(self, x):
-        self.x_means = np.nanmean(self.x, axis=0)
-        index = np.argmin(np.abs(self.x_means - x))
+        index = self.get_derived('x_means_index', (self.x,), lambda x: SortedIndex(self.x_means)).nearest(x)
         return self.y[:,index], self.z[:,index], self.row_numbers[:,index], index
 
     def get_row_at(self, y):
-        self.y_means = np.nanmean(self.y, axis=1)
-        index = np.argmin(np.abs(self.y_means - y))
+        index = self.get_derived('y_means_index', (self.y,), lambda y: SortedIndex(self.y_means)).nearest(y)
         return self.x[index], self.z[index], self.row_numbers[index], index
 
     def get_closest_x(self, x_coord):
-        return min(self.x[0,:], key=lambda x:abs(x - x_coord))
+        index = self.get_derived('x_index', (self.x,), lambda x: SortedIndex(x[0,:])).nearest(x_coord)
+        return self.x[0,index]
 
     def get_closest_y(self, y_coord):
-        return min(self.y[:,0], key=lambda y:abs(y - y_coord))
+        index = self.get_derived('y_index', (self.y,), lambda y: SortedIndex(y[:,0])).nearest(y_coord)
+        return self.y[index,0]
 
     def flip_axes(self, x_flip, y_flip):
         if x_flip:
@@ -640,15 +1268,72 @@ class Data2D:
 
         return x_flip, y_flip
 
+    def get_nbytes(self):
+        return sum(a.nbytes for a in (self.x, self.y, self.z, self.row_numbers))
+
+    def own(self, *names):
+        """
+        Make the arrays names ('x', 'y', 'z' or 'row_numbers') private copies before
+        they are modified in place, unless they were copied by this Data2D already.
+        """
+        for name in names:
+            a = getattr(self, name)
+            # Values derived from the array are computed again
+            for key, (sources, _) in list(self.derived.items()):
+                if any(s is a for s in sources):
+                    del self.derived[key]
+            if self.owned.get(name) is not a:
+                a = np.array(a)
+                setattr(self, name, a)
+                self.owned[name] = a
+
     def copy(self):
+        """
+        Return a Data2D which shares the arrays with this one (copy-on-write). The shared
+        arrays become read-only, so operations which modify them in place call own() first.
+        """
+        for a in (self.x, self.y, self.z, self.row_numbers):
+            if isinstance(a, np.ndarray):
+                a.flags.writeable = False
+        self.owned = {}
         scan_info_old = self.scan_info
-        d = Data2D(np.copy(self.x), np.copy(self.y), np.copy(self.z), np.copy(self.row_numbers),
+        d = Data2D(self.x, self.y, self.z, self.row_numbers,
                       self.x_name, self.y_name, self.z_name,
                       self.filename, self.timestamp, self.dat_file)
         for i in scan_info_old:
             d.scan_info[i] = scan_info_old[i]
         return d
         
+    def apply_elementwise(self, steps, block_size=ELEMENTWISE_BLOCK_SIZE):
+        """
+        Apply the steps of elementwise_steps in a single pass over blocks of every
+        array which fit in the CPU cache, without intermediate arrays. Only the
+        steps after a subtraction of the minimum need a second pass.
+        """
+        for name in ('x', 'y', 'z'):
+            funcs = [step for n, step in steps if n == name]
+            if not funcs:
+                continue
+            self.own(name)
+            a = getattr(self, name)
+            flat = a.ravel(order='K')# a view, own() makes a contiguous copy
+
+            def run(funcs):
+                for i in range(0, flat.size, block_size):
+                    block = flat[i:i+block_size]
+                    for func in funcs:
+                        func(block)
+
+            group = []
+            for func in funcs:
+                if func is None:
+                    run(group)
+                    m = np.nanmin(a)
+                    group = [lambda b, m=m: np.subtract(b, m, out=b)]
+                else:
+                    group.append(func)
+            run(group)
+
     def abs(self):
         """Take the absolute value of every datapoint."""
         self.z = np.absolute(self.z)
@@ -745,14 +1430,13 @@ class Data2D:
 
             self.set_data(xcomp.x[1:-1,:], ycomp.y[:,1:-1], np.sqrt(xvalues**2 + yvalues**2))
 
-    def highpass(self, x_width=3, y_height=3, method='gaussian'):
-        """Perform a high-pass filter."""
-        kernel = create_kernel(x_width, y_height, 7, method)
-        self.z = self.z - ndimage.filters.convolve(self.z, kernel)
+    def highpass(self, x_width=3, y_height=3, method='gaussian', ignore_nan=False):
+        """Perform a high-pass filter. With ignore_nan, NaN values are left out of the averages."""
+        self.z = self.z - filters.convolve(self.z, x_width, y_height, 7, method, ignore_nan)
 
     def hist2d(self, min, max, bins):
         """Convert every column into a histogram, default bin amount is sqrt(n)."""
-        hist = np.apply_along_axis(lambda x: np.histogram(x, bins=bins, range=(min, max))[0], 0, self.z)
+        hist = histogram_columns(self.z, min, max, bins)
 
         binedges = np.linspace(min, max, bins + 1)
         bincoords = (binedges[:-1] + binedges[1:]) / 2
@@ -762,16 +1446,16 @@ class Data2D:
         self.z = hist
 
     def interp_grid(self, width, height):
-        """Interpolate the data onto a uniformly spaced grid using barycentric interpolation."""
-        # NOT WOKRING FOR SOME REASON
+        """Interpolate the data onto a uniformly spaced grid, see interpolate."""
         xmin, xmax, ymin, ymax, _, _ = self.get_limits()
 
         x = np.linspace(xmin, xmax, width)
         y = np.linspace(ymin, ymax, height)
         xv, yv = np.meshgrid(x, y)
 
-        self.x, self.y = xv, yv
-        self.z = np.reshape(self.interpolate(np.column_stack((xv.flatten(), yv.flatten()))), xv.shape)
+        # Interpolate before the coordinates are replaced
+        z = np.reshape(self.interpolate(np.column_stack((xv.flatten(), yv.flatten()))), xv.shape)
+        self.set_data(xv, yv, z)
 
     def interp_x(self, points):
         """Interpolate every row onto a uniformly spaced grid."""
@@ -780,12 +1464,7 @@ class Data2D:
         x = np.linspace(xmin, xmax, points)
 
         rows = self.z.shape[0]
-        values = np.zeros((rows, points))
-
-        for i in range(rows):
-            f = interpolate.interp1d(self.x[i], self.z[i],
-                                     bounds_error=False, fill_value=np.nan)
-            values[i] = f(x)
+        values = interp_rows(self.x, self.z, x)
 
         y_avg = np.average(self.y, axis=1)[np.newaxis].T
 
@@ -798,48 +1477,42 @@ class Data2D:
         y = np.linspace(ymin, ymax, points)[np.newaxis].T
 
         cols = self.z.shape[1]
-        values = np.zeros((points, cols))
-
-        for i in range(cols):
-            f = interpolate.interp1d(self.y[:,i].ravel(), self.z[:,i].ravel(),
-                                     bounds_error=False, fill_value=np.nan)
-            values[:,i] = f(y).ravel()
+        values = interp_rows(self.y.T, self.z.T, y.ravel()).T
 
         x_avg = np.average(self.x, axis=0)
 
         self.set_data(np.tile(x_avg, (points,1)), np.tile(y, (1,cols)), values)
 
-    def lowpass(self, x_width=3, y_height=3, method='gaussian'):
-        """Perform a low-pass filter."""
-        kernel = create_kernel(x_width, y_height, 7, method)
-        self.z = ndimage.filters.convolve(self.z, kernel)
+    def lowpass(self, x_width=3, y_height=3, method='gaussian', ignore_nan=False):
+        """Perform a low-pass filter. With ignore_nan, NaN values are left out of the averages."""
+        self.z = filters.convolve(self.z, x_width, y_height, 7, method, ignore_nan)
         # self.z = np.ma.masked_invalid(self.z) masked array doesn't works with np.tofile() (for saving as .mtx)
 
     def negate(self):
         """Negate every datapoint."""
+        self.own('z')
         self.z *= -1
 
     def norm_columns(self):
         """Transform the values of every column so that they use the full colormap."""
-        def func(x):
-            return (x - np.nanmin(x)) / (np.nanmax(x) - np.nanmin(x))
-
-        self.z = np.apply_along_axis(func, 0, self.z)
+        zmin, zmax = np.nanmin(self.z, axis=0), np.nanmax(self.z, axis=0)
+        self.z = (self.z - zmin) / (zmax - zmin)
 
     def norm_rows(self):
         """Transform the values of every row so that they use the full colormap."""
-        def func(x):
-            return (x - np.nanmin(x)) / (np.nanmax(x) - np.nanmin(x))
-
-        self.z = np.apply_along_axis(func, 1, self.z)
+        zmin, zmax = np.nanmin(self.z, axis=1), np.nanmax(self.z, axis=1)
+        self.z = (self.z - zmin[:,np.newaxis]) / (zmax - zmin)[:,np.newaxis]
 
     def offset(self, x_offset=0, y_offset=0, z_offset=0):
         """Add a value to every datapoint."""
         if x_offset != 0:
+            self.own('x')
             self.x += x_offset
         if y_offset != 0:
+            self.own('y')
             self.y += y_offset
         if z_offset != 0:
+            self.own('z')
             self.z += z_offset
 
     def power(self, x_power=1, y_power=1, z_power=1):
@@ -854,10 +1527,13 @@ class Data2D:
     def scale(self, x_scale=1, y_scale=1, z_scale=1):
         """Scale x, y, and z values."""
         if x_scale != 1:
+            self.own('x')
             self.x *= x_scale
         if y_scale != 1:
+            self.own('y')
             self.y *= y_scale
         if z_scale != 1:
+            self.own('z')
             self.z *= z_scale
 
     def log(self, x, y, z):
@@ -878,23 +1554,31 @@ class Data2D:
             x, y, row_numbers, index = self.get_column_at(position)
             y = np.tile(self.z[:,index][:,np.newaxis], (1, self.z.shape[1]))
 
+        self.own('z')
         self.z -= y
         
     def sub_min(self,x,y,z):
         """Subtract the minimum value"""
         if x:
+            self.own('x')
             self.x -= np.nanmin(self.x)
         if y:
+            self.own('y')
             self.y -= np.nanmin(self.y)
         if z:
+            self.own('z')
             self.z -= np.nanmin(self.z)
 
-    def sub_linecut_avg(self, type, position, size):
-        """Subtract a horizontal/vertical averaged linecut from every row/column."""
+    def sub_linecut_avg(self, type, position, size, ignore_nan=False):
+        """
+        Subtract a horizontal/vertical averaged linecut from every row/column.
+        With ignore_nan, NaN values are left out of the average.
+        """
         if size % 2 == 0:
-            start, end = -size/2, size/2-1
+            start, end = -size//2, size//2-1
         else:
-            start, end = -(size-1)/2, (size-1)/2
+            start, end = -(size-1)//2, (size-1)//2
+        mean = np.nanmean if ignore_nan else np.mean
 
         indices = np.arange(start, end + 1)
 
@@ -902,21 +1586,23 @@ class Data2D:
             x, y, row_numbers, index = self.get_row_at(position)
             if start + index < 0 or end + index > self.z.shape[0]-1:
                 return
-            y = np.mean(self.z[index+indices,:], axis=0)
+            y = mean(self.z[index+indices,:], axis=0)
             y = np.tile(y, (self.z.shape[0],1))
         elif type == 'vertical':
             x, y, row_numbers, index = self.get_column_at(position)
             if start + index < 0 or end + index > self.z.shape[1]-1:
                 return
-            y = np.mean(self.z[:,index+indices], axis=1)
+            y = mean(self.z[:,index+indices], axis=1)
             y = np.tile(y[:,np.newaxis], (1, self.z.shape[1]))
 
+        self.own('z')
         self.z -= y
 
     def sub_plane(self, x_slope, y_slope):
         """Subtract a plane with x and y slopes centered in the middle."""
         xmin, xmax, ymin, ymax, _, _ = self.get_limits()
 
+        self.own('z')
         self.z -= x_slope*(self.x - (xmax - xmin)/2) + y_slope*(self.y - (ymax - ymin)/2)
 
     def xderiv(self, method='midpoint'):
@@ -971,6 +1657,7 @@ class Data2D:
             
     def reverse_odd_rows(self,shift=0):
         """Reverse and shift odd rows. For a meander scan. [1::2, :]->[1::2, ::-1]"""
+        self.own('x', 'z')
         self.x[1::2, :] = self.x[1::2, ::-1]
         if shift>0:
             self.z[1::2, :shift] = np.nan
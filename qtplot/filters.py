@@ -0,0 +1,134 @@
+import logging
+import threading
+
+import numpy as np
+from scipy import ndimage
+from scipy.signal import fftconvolve
+
+from .cache import MemoryCache
+
+logger = logging.getLogger(__name__)
+
+DIRECT_KERNEL_SIZE = 49  # kernels with at most this many elements are convolved directly
+FFT_KERNEL_SIZE = 400  # non-separable kernels with more elements are convolved by FFT
+
+# {(x_dev, y_dev, cutoff, distr): (kernel, separated kernel)}, least recently used
+# kernels are removed, a large width can make a kernel as large as the data
+_kernels = MemoryCache(100)
+_kernels_lock = threading.Lock()
+
+
+def create_kernel(x_dev, y_dev, cutoff, distr):
+    distributions = {
+        'gaussian': lambda r: np.exp(-(r**2) / 2.0),
+        'exponential': lambda r: np.exp(-abs(r) * np.sqrt(2.0)),
+        'lorentzian': lambda r: 1.0 / (r**2+1.0),
+        'thermal': lambda r: np.exp(r) / (1 * (1+np.exp(r))**2)
+    }
+    func = distributions[distr]
+
+    hx = np.floor((x_dev * cutoff) / 2.0)
+    hy = np.floor((y_dev * cutoff) / 2.0)
+
+    x = np.linspace(-hx, hx, int(hx * 2 + 1)) / x_dev
+    y = np.linspace(-hy, hy, int(hy * 2 + 1)) / y_dev
+
+    if x.size == 1: x = np.zeros(1)
+    if y.size == 1: y = np.zeros(1)
+
+    xv, yv = np.meshgrid(x, y)
+
+    kernel = func(np.sqrt(xv**2+yv**2))
+    kernel /= np.sum(kernel)
+
+    return kernel
+
+
+def separate_kernel(kernel, tol=1e-12):
+    """
+    Return (column, row) 1d kernels whose outer product is kernel, or None if the
+    kernel is not separable (its rank is not 1).
+    """
+    u, s, vt = np.linalg.svd(kernel)
+    if s[0] == 0 or s[1:].sum() > tol * s[0]:
+        return None
+    column, row = u[:,0] * np.sqrt(s[0]), vt[0] * np.sqrt(s[0])
+    if column.sum() < 0:
+        column, row = -column, -row
+    return column, row
+
+
+def get_kernel(x_dev, y_dev, cutoff, distr):
+    """ create_kernel and separate_kernel of it, cached. Don't modify the kernels. """
+    key = (x_dev, y_dev, cutoff, distr)
+    with _kernels_lock:
+        kernels = _kernels.get(key)
+        if kernels is None:
+            kernel = create_kernel(x_dev, y_dev, cutoff, distr)
+            separated = separate_kernel(kernel) if kernel.size > DIRECT_KERNEL_SIZE else None
+            kernel.flags.writeable = False
+            kernels = kernel, separated
+            nbytes = kernel.nbytes + (sum(a.nbytes for a in separated) if separated else 0)
+            _kernels.put(key, kernels, nbytes)
+        return kernels
+
+
+def convolve(z, x_dev, y_dev, cutoff, distr, ignore_nan=False):
+    """
+    ndimage.convolve(z, create_kernel(x_dev, y_dev, cutoff, distr)) with reflected
+    edges. Small kernels are convolved directly, separable ones (gaussian) by two
+    1d passes and other large ones by FFT if z is float.
+
+    With ignore_nan, NaN don't spread but are left out (normalized convolution):
+    the zero-filled values and the mask of valid values are convolved in one
+    batch, the first divided by the second is the average of the valid values
+    under the kernel. NaN stay NaN.
+    """
+    kernel, separated = get_kernel(x_dev, y_dev, cutoff, distr)
+    if ignore_nan and z.dtype.kind == 'f':
+        valid = ~np.isnan(z)
+        if not valid.all():
+            stack = np.array([np.where(valid, z, 0), valid], dtype=z.dtype)
+            total, weight = convolve_kernel(stack, kernel, separated)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                result = total / weight
+            result[~valid] = np.nan
+            return result
+    return convolve_kernel(z, kernel, separated)
+
+
+def convolve_kernel(z, kernel, separated=None):
+    """
+    Convolve the last two axes of z with a 2d kernel, the other axes are a batch.
+    separated is the result of separate_kernel or None.
+    """
+    kernel_nd = kernel.reshape((1,) * (z.ndim - 2) + kernel.shape)
+    if kernel.size <= DIRECT_KERNEL_SIZE:
+        return ndimage.convolve(z, kernel_nd)
+    if separated is not None:
+        column, row = separated
+        return ndimage.convolve1d(ndimage.convolve1d(z, column, axis=-2), row, axis=-1)
+    if kernel.size > FFT_KERNEL_SIZE and z.dtype.kind == 'f':
+        return fft_convolve(z, kernel)
+    return ndimage.convolve(z, kernel_nd)
+
+
+def fft_convolve(z, kernel):
+    """
+    ndimage.convolve(z, kernel) with reflected edges over the last two axes of z,
+    computed by FFT. NaN are zero-filled, the values whose kernel covers a NaN are
+    NaN again afterwards.
+    """
+    hy, hx = kernel.shape[0] // 2, kernel.shape[1] // 2
+    kernel = kernel.reshape((1,) * (z.ndim - 2) + kernel.shape)
+    # ndimage's 'reflect' is numpy's 'symmetric': d c b a | a b c d | d c b a
+    padded = np.pad(z, ((0, 0),) * (z.ndim - 2) + ((hy, hy), (hx, hx)), mode='symmetric')
+    nans = np.isnan(padded)
+    if nans.any():
+        padded[nans] = 0
+    result = fftconvolve(padded, kernel, mode='valid')
+    if nans.any():
+        # The number of NaN under the kernel, rounded
+        covered = fftconvolve(nans.astype(np.float64), (kernel != 0).astype(np.float64), mode='valid')
+        result[covered > 0.5] = np.nan
+    return result.astype(z.dtype, copy=False)
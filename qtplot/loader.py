@@ -0,0 +1,50 @@
+from PyQt4 import QtCore
+import logging
+from time import time
+
+from .parser import LoadCancelled
+
+logger = logging.getLogger(__name__)
+
+
+class Loader(QtCore.QThread):
+    """
+    Runs job(loader) outside of the GUI thread. The job can call loader.check() or
+    loader.report(parsed bytes, total bytes, rows), which raise LoadCancelled after
+    cancel() was called. When the job is done, done(result, error) is emitted and
+    handled in the GUI thread.
+    """
+    progress = QtCore.pyqtSignal(str)
+    done = QtCore.pyqtSignal(object, object)
+
+    def __init__(self, job, parent=None):
+        super(Loader, self).__init__(parent)
+        self.job = job
+        self.cancelled = False
+        self.last_report = 0
+        self.finished.connect(self.deleteLater)
+
+    def run(self):
+        try:
+            result = self.job(self)
+        except LoadCancelled as e:
+            self.done.emit(None, e)
+        except Exception as e:
+            logger.exception('Loader: %s' % e)
+            self.done.emit(None, e)
+        else:
+            self.done.emit(result, None)
+
+    def cancel(self):
+        self.cancelled = True
+
+    def check(self):
+        if self.cancelled:
+            raise LoadCancelled()
+
+    def report(self, parsed, total, rows):
+        self.check()
+        now = time()
+        if now - self.last_report > 0.1:# don't flood the event loop
+            self.last_report = now
+            self.progress.emit('%d%% %d rows' % (100.*parsed/max(total, 1), rows))
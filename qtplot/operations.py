@@ -6,7 +6,7 @@ import six
 
 from PyQt4 import QtGui, QtCore
 
-from .data import Data2D
+from .data import Data2D, elementwise_steps
 
 
 class Operation(QtGui.QWidget):
@@ -115,6 +115,8 @@ class Operations(QtGui.QDialog):
         self.main = parent
         self.columns = None
         self.op_str = ''
+        self.stage_cache = None# MemoryCache of the results of the operations, set by QTPlot
+        self.stage_dat_file = None# DatFile of the cached results
 
         self.init_ui()
 
@@ -149,7 +151,8 @@ class Operations(QtGui.QDialog):
                                                 'gaussian',
                                                 'lorentzian',
                                                 'exponential',
-                                                'thermal'])]],
+                                                'thermal']),
+                                           ('ignore_nan', False)]],
             'hist2d': [Data2D.hist2d, [('min', 0.0),
                                        ('max', 0.0),
                                        ('bins', 0)]],
@@ -163,7 +166,8 @@ class Operations(QtGui.QDialog):
                                          ('method', ['gaussian',
                                                      'lorentzian',
                                                      'exponential',
-                                                     'thermal'])]],
+                                                     'thermal']),
+                                         ('ignore_nan', False)]],
             'negate': [Data2D.negate],
             'norm y': [Data2D.norm_columns],
             'norm x': [Data2D.norm_rows],
@@ -171,7 +175,7 @@ class Operations(QtGui.QDialog):
             'power': [Data2D.power, [('x_power', 1.0), ('y_power', 1.0), ('z_power', 1.0)]],
             'scale': [Data2D.scale, [('x_scale', 1.0), ('y_scale', 1.0), ('z_scale', 1.0)]],
             'sub linecut': [Data2D.sub_linecut, [('type', ['horizontal', 'vertical']), ('position', float('nan'))]],
-            'sub linecut avg': [Data2D.sub_linecut_avg, [('type', ['horizontal', 'vertical']), ('position', float('nan')), ('size', 3)]],
+            'sub linecut avg': [Data2D.sub_linecut_avg, [('type', ['horizontal', 'vertical']), ('position', float('nan')), ('size', 3), ('ignore_nan', False)]],
             'sub_min': [Data2D.sub_min, [('x', False),('y', False),('z', False)]],
             'sub plane': [Data2D.sub_plane, [('x_slope', 0.0),
                                              ('y_slope', 0.0)]],
@@ -316,8 +320,17 @@ class Operations(QtGui.QDialog):
             return str(val)
     
     def apply_operations(self, data):
-        copy = data.copy()
-        self.op_str = ''
+        copy, self.op_str, updates = self.run_queue(data, self.get_queue())
+        for op, name, value in updates:
+            op.set_parameter(name, value)
+        return copy
+
+    def get_queue(self):
+        """
+        Return a list of (operation, parameters) of the enabled operations. The
+        parameters are read from the widgets, so call this in the GUI thread.
+        """
+        queue = []
         for i in range(self.queue.count()):
             item = self.queue.item(i)
 
@@ -329,29 +342,98 @@ class Operations(QtGui.QDialog):
             elif six.PY3:
                 op = item.data(QtCore.Qt.UserRole)
 
-            # Special logic is needed for the hist2 and sub linecut
-            if op.name == 'hist2d':
-                if op.get_parameter('bins') == 0:
-                    bins = np.round(np.sqrt(copy.z.shape[0]))
-                    op.set_parameter('bins', int(bins))
-
-                if op.get_parameter('min') == 0:
-                    min, max = np.nanmin(copy.z), np.nanmax(copy.z)
-                    op.set_parameter('min', min)
-                    op.set_parameter('max', max)
-            elif op.name == 'sub linecut' or op.name == 'sub linecut avg':
+            # Special logic is needed for the sub linecut
+            if op.name == 'sub linecut' or op.name == 'sub linecut avg':
                 if (self.main.canvas.line_coord is not None and
                    self.main.canvas.line_type is not None):
                     if math.isnan(op.get_parameter('position')):
                         op.set_parameter('type', self.main.canvas.line_type)
                         op.set_parameter('position', self.main.canvas.line_coord)
 
-            _ = [self.para_value_to_str(i) for i in [op.get_parameter(name) for name in op.para_names]]#function parameters
-            self.op_str += '%s[%s];'%(op.name,','.join(_))
-            
-            kwargs = op.get_parameters()[1]
+            queue.append((op, op.get_parameters()[1]))
+        return queue
+
+    def run_queue(self, data, queue, check=None, key=None):
+        """
+        Apply the operations of get_queue to a copy of data, calling check() before
+        each of them. The widgets are not touched, so this can run in another thread.
+        Return the result, the operations string and a list of (operation, name, value)
+        of parameters determined from the data, which should be set in the widgets.
+        The values z keep their dtype (the precision of the profile).
+
+        If key identifies data, the result of every operation is cached under the key
+        of its input, its name and its parameters, so only the operations after a
+        changed one are computed again. The result is a copy (see Data2D.copy) even
+        if it comes from the cache.
+
+        Runs of consecutive elementwise operations (scale, offset, log, ...) are fused
+        into a single pass over the data, only the result of a run is cached.
+        """
+        cache = self.stage_cache if key is not None else None
+        if cache is not None and data.dat_file is not self.stage_dat_file:
+            cache.clear()# only keep the results of the current DatFile
+            self.stage_dat_file = data.dat_file
+        copy = data
+        dtype = data.z.dtype
+        op_str = ''
+        updates = []
+        pending = []# steps of the current run of elementwise operations
+        pending_key = None
+
+        def flush(copy):
+            if pending:
+                copy = copy.copy()
+                copy.apply_elementwise(pending)
+                if cache is not None:
+                    cache.put(pending_key, copy, copy.get_nbytes())
+                del pending[:]
+            return copy
+
+        for op, kwargs in queue:
+            if check is not None:
+                check()
+
+            # Special logic is needed for the hist2d
+            if op.name == 'hist2d':
+                copy = flush(copy)
+                if kwargs['bins'] == 0:
+                    bins = np.round(np.sqrt(copy.z.shape[0]))
+                    kwargs['bins'] = int(bins)
+                    updates.append((op, 'bins', int(bins)))
+
+                if kwargs['min'] == 0:
+                    min, max = copy.get_stats().get_min_max()
+                    # As if read back from the widgets
+                    kwargs['min'], kwargs['max'] = float(str(min)), float(str(max))
+                    updates += [(op, 'min', min), (op, 'max', max)]
+
+            _ = [self.para_value_to_str(i) for i in [kwargs[name] for name in op.para_names]]#function parameters
+            op_str += '%s[%s];'%(op.name,','.join(_))
+
+            if cache is not None:
+                key = (key, op.name, repr(sorted(kwargs.items())))# repr, since nan != nan
+                cached = cache.get(key)
+                if cached is not None:
+                    copy = cached
+                    del pending[:]# the run up to here is cached
+                    continue
+
+            steps = elementwise_steps(op.func, kwargs)
+            # In place only for floats, like int arrays can't hold a log
+            if steps is not None and all(getattr(copy, name).dtype.kind == 'f' for name, _ in steps):
+                pending += steps
+                pending_key = key
+                continue
+
+            copy = flush(copy)
+            copy = copy.copy()
             op.func(copy, **kwargs)
-        return copy
+            if copy.z.dtype != dtype:
+                copy.z = copy.z.astype(dtype)
+            if cache is not None:
+                cache.put(key, copy, copy.get_nbytes())
+        # A new Data2D sharing the arrays, cached results are not modified by the caller
+        return flush(copy).copy(), op_str, updates
 
     def show_window(self):
         if self.isHidden():
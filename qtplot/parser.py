@@ -0,0 +1,219 @@
+import logging
+import multiprocessing
+import ctypes
+
+import numpy as np
+from pandas.io.api import read_table
+
+logger = logging.getLogger(__name__)
+
+MIN_PARALLEL_SIZE = 64e6  # bytes, smaller data sections are parsed in the main process
+CHUNK_SIZE = 32e6  # bytes per task of the process pool
+
+
+class BoundedFile:
+    """ Read-only view of an open file which stops at a given byte offset. """
+
+    def __init__(self, f, end):
+        self.f = f
+        self.end = end
+
+    def read(self, size=-1):
+        left = max(self.end - self.f.tell(), 0)
+        if size is None or size < 0 or size > left:
+            size = left
+        return self.f.read(size)
+
+    def readline(self, size=-1):
+        left = max(self.end - self.f.tell(), 0)
+        if size is None or size < 0 or size > left:
+            size = left
+        return self.f.readline(size)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        line = self.readline()
+        if not line:
+            raise StopIteration
+        return line
+
+    next = __next__
+
+
+class ParallelParseError(Exception):
+    """ The data can not be parsed in chunks, parse it in one piece instead. """
+    pass
+
+
+class LoadCancelled(Exception):
+    """ Raised by a progress callback to stop loading a file. """
+    pass
+
+
+def read_chunk(f, start, end, usecols=None):
+    """
+    Parse the tab separated lines between byte offsets start and end of the open
+    file f. Only the columns usecols are returned, in that order.
+    """
+    f.seek(start)
+    df = read_table(BoundedFile(f, end), comment='#', sep='\t', header=None, usecols=usecols)
+    return (df if usecols is None else df[list(usecols)]).values
+
+
+def has_data_lines(f, start, end):
+    """ Whether there are lines other than blank or comment lines between start and end. """
+    f.seek(start)
+    return any(l.strip() and not l.startswith(b'#') for l in f.read(end - start).splitlines())
+
+
+def read_chunks(f, start, end, usecols=None, progress=None):
+    """
+    Same as read_chunk, but parse pieces of CHUNK_SIZE bytes and call
+    progress(parsed bytes, total bytes, parsed rows) after every piece.
+    """
+    blocks = []
+    rows = 0
+    for s, e in split_lines(f, start, end, CHUNK_SIZE):
+        try:
+            values = read_chunk(f, s, e, usecols)
+        except ValueError:
+            if has_data_lines(f, s, e):
+                raise
+            continue
+        blocks.append(values)
+        rows += len(values)
+        if progress is not None:
+            progress(e - start, end - start, rows)
+    if not blocks:
+        raise ValueError('No data lines')
+    return blocks[0] if len(blocks) == 1 else np.vstack(blocks)
+
+
+def split_lines(f, start, end, chunk_size):
+    """ Split the byte range [start, end) of f into ranges which start at a line. """
+    bounds = [start]
+    while end - bounds[-1] > chunk_size:
+        f.seek(int(bounds[-1] + chunk_size))
+        f.readline()
+        pos = f.tell()
+        if pos >= end:
+            break
+        bounds.append(pos)
+    bounds.append(end)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def count_rows(args):
+    """
+    Count the data lines in a byte range and the number of fields of the first one.
+    Blank lines and lines starting with '#' are skipped by read_table as well.
+    """
+    filename, start, end = args
+    with open(filename, 'rb') as f:
+        f.seek(start)
+        buf = f.read(end - start)
+    if not buf:
+        return 0, 0
+    a = np.frombuffer(buf, np.uint8)
+    first = np.concatenate(([0], np.flatnonzero(a[:-1] == ord('\n')) + 1))
+    c = a[first]
+    is_data = (c != ord('\n')) & (c != ord('\r')) & (c != ord('#'))
+    n_rows = int(np.count_nonzero(is_data))
+    n_fields = 0
+    if n_rows:
+        i = first[np.argmax(is_data)]
+        line = buf[i:buf.find(b'\n', i)].rstrip(b'\r')
+        n_fields = line.count(b'\t') + 1
+    return n_rows, n_fields
+
+
+_shared = {}
+
+
+def init_worker(filename, data, shape):
+    _shared['filename'] = filename
+    _shared['data'] = data
+    _shared['shape'] = shape
+
+
+def parse_into(args):
+    """
+    Parse a byte range into the rows [row, row+n_rows) of the shared array. Return
+    whether the values were floats, None if they don't fit.
+    """
+    start, end, row, n_rows, usecols = args
+    with open(_shared['filename'], 'rb') as f:
+        values = read_chunk(f, start, end, usecols)
+    if values.dtype.kind not in 'fi' or values.shape != (n_rows, _shared['shape'][1]):
+        return None
+    out = np.frombuffer(_shared['data'], np.float64).reshape(_shared['shape'])
+    out[row:row+n_rows] = values
+    return values.dtype.kind == 'f'
+
+
+def run_pool(workers, func, tasks, initializer=(None, ()), on_result=None):
+    """
+    Map func over tasks in a new process pool, on_result(task, result) is called as
+    the results come in. Errors are raised as ParallelParseError.
+    """
+    pool = multiprocessing.Pool(workers, *initializer)
+    try:
+        results = []
+        for task, result in zip(tasks, pool.imap(func, tasks)):
+            results.append(result)
+            if on_result is not None:
+                on_result(task, result)
+        return results
+    except LoadCancelled:
+        raise
+    except Exception as e:
+        raise ParallelParseError(e)
+    finally:
+        pool.terminate()
+
+
+def parse_parallel(filename, start, end, usecols=None, workers=None, progress=None):
+    """
+    Parse the data lines between byte offsets start and end of a text data file
+    in a process pool. The range is split at line ends, the rows of every chunk are
+    counted first, then the chunks are parsed into a shared preallocated array.
+    The result is identical to read_chunk on the whole range. Raise
+    ParallelParseError if the chunks can not be parsed consistently. progress is
+    called like in read_chunks.
+    """
+    workers = workers or multiprocessing.cpu_count()
+    with open(filename, 'rb') as f:
+        ranges = split_lines(f, start, end, min(CHUNK_SIZE, (end - start) / workers + 1))
+
+    counts = run_pool(workers, count_rows, [(filename, s, e) for s, e in ranges])
+    n_fields = set(n for n_rows, n in counts if n_rows)
+    if not n_fields:
+        raise ParallelParseError('No data lines')
+    if len(n_fields) > 1:
+        raise ParallelParseError('Number of columns is not constant: %s' % sorted(n_fields))
+    n_cols = n_fields.pop() if usecols is None else len(usecols)
+    n_rows = [n for n, _ in counts]
+    offsets = np.concatenate(([0], np.cumsum(n_rows)))
+    shape = (int(offsets[-1]), n_cols)
+
+    data = multiprocessing.RawArray(ctypes.c_double, shape[0] * shape[1])
+    tasks = [(s, e, int(row), n, usecols) for (s, e), row, n in zip(ranges, offsets, n_rows) if n]
+    parsed = [0, 0]# bytes, rows
+
+    def on_result(task, result):
+        parsed[0] += task[1] - task[0]
+        parsed[1] += task[3]
+        if progress is not None:
+            progress(parsed[0], end - start, parsed[1])
+
+    results = run_pool(workers, parse_into, tasks, (init_worker, (filename, data, shape)), on_result)
+    if any(r is None for r in results):
+        raise ParallelParseError('Rows not counted correctly or data is not numeric')
+    logger.info('parse_parallel: %d rows parsed in %d chunks by %d workers' % (shape[0], len(tasks), workers))
+    data = np.frombuffer(data, np.float64).reshape(shape)
+    if not any(results):
+        # All integer, like read_table on the whole range
+        data = data.astype(np.int64)
+    return data
@@ -5,6 +5,7 @@ import numpy as np
 import os
 import logging
 import sys
+import multiprocessing
 from collections import OrderedDict
 from PyQt4 import QtGui, QtCore
 from .colormap import Colormap
@@ -15,6 +16,9 @@ from .operations import Operations
 from .settings import Settings
 from .canvas import Canvas
 from .server import qpServer
+from .cache import ParseCache, MemoryCache
+from .loader import Loader
+from .util import get_next_filename
 from time import time
 
 logger = logging.getLogger(__name__)
@@ -66,7 +70,8 @@ PROFILE_DEFAULTS = OrderedDict((
     ('line_width', '0.5'),
     ('marker_style', 'None'),
     ('marker_size', '6'),
-    ('incl_z', True)
+    ('incl_z', True),
+    ('precision', 'float64'),# or float32, for the values of the data and the operations
 ))
 
 
@@ -83,6 +88,12 @@ class QTPlot(QtGui.QMainWindow):
         self.abs_filename = None
         self.max_load_time = 0
         self.data = None
+        self.file_loader = None# Loader of the file being loaded
+        self.prefetcher = None# Loader of the neighboring files
+        self.data_loader = None# Loader of the data being processed by on_data_change
+        self.triangulator = None# Loader of the triangulation for the diagonal linecut
+        self.t_load = None
+        self.cb_indices = []# combo box indexes when the last file load was started
         
         self.init_logging()
 
@@ -113,7 +124,13 @@ class QTPlot(QtGui.QMainWindow):
 
         self.qtplot_ini_file = os.path.join(self.settings_dir, 'qtplot.ini')
 
-        defaults = {'default_profile': 'default.ini'}
+        defaults = {'default_profile': 'default.ini', 'cache_size': '1000',# cache_size in MB
+                    'lazy_columns': 'True',# parse only the columns being plotted, others when needed
+                    'parse_workers': '0',# processes parsing large text files, 0 for all cores
+                    'prefetch': '2',# number of next and previous numbered files loaded in advance
+                    'memory_cache_size': '2000',# in MB, for recently loaded and prefetched files
+                    'pipeline_cache_size': '500',# in MB, for the results of the operations
+                    'triangulation_cache_size': '500'}# in MB, for the diagonal linecuts
         self.profile_settings = defaults
         self.qtplot_ini = configparser.SafeConfigParser(defaults)#initialize qtplot_ini
         self.profile_ini = configparser.SafeConfigParser(PROFILE_DEFAULTS)#initialize profile_ini
@@ -126,6 +143,17 @@ class QTPlot(QtGui.QMainWindow):
             with open(self.qtplot_ini_file, 'w') as config_file:
                 self.qtplot_ini.write(config_file)
 
+        # On-disk cache of parsed text data files
+        self.parse_cache = ParseCache(os.path.join(self.settings_dir, 'cache'),
+                                      self.qtplot_ini.getfloat('DEFAULT', 'cache_size'))
+        self.lazy_columns = self.qtplot_ini.getboolean('DEFAULT', 'lazy_columns')
+        self.parse_workers = self.qtplot_ini.getint('DEFAULT', 'parse_workers')
+        # Recently loaded and prefetched files, used by DatFile
+        self.dataset_cache = MemoryCache(self.qtplot_ini.getfloat('DEFAULT', 'memory_cache_size'))
+        self.n_prefetch = self.qtplot_ini.getint('DEFAULT', 'prefetch')
+        self.operations.stage_cache = MemoryCache(self.qtplot_ini.getfloat('DEFAULT', 'pipeline_cache_size'))
+        Data2D.triangulations = MemoryCache(self.qtplot_ini.getfloat('DEFAULT', 'triangulation_cache_size'))
+
         default_profile = self.qtplot_ini.get('DEFAULT', 'default_profile')#get filename
         self.profile_ini_file = os.path.join(self.profiles_dir, default_profile)
 
@@ -415,6 +443,12 @@ class QTPlot(QtGui.QMainWindow):
         self.l_slope.setTextInteractionFlags(QtCore.Qt.TextSelectableByMouse|QtCore.Qt.TextSelectableByKeyboard)
         self.l_slope.setToolTip('Linecut slope')
         self.status_bar.addWidget(self.l_slope)
+        self.l_progress = QtGui.QLabel('')
+        self.l_progress.setToolTip('Loading progress, number of rows')
+        self.status_bar.addWidget(self.l_progress)
+        self.l_cache = QtGui.QLabel('')
+        self.l_cache.setToolTip('Hits/misses of the dataset cache')
+        self.status_bar.addWidget(self.l_cache)
         self.load_time = QtGui.QLabel('t (t_max)')
         self.load_time.setToolTip('Loading time (max loading time) in ms')
         self.status_bar.addWidget(self.load_time)     
@@ -497,23 +531,106 @@ class QTPlot(QtGui.QMainWindow):
 
     def load_dat_file(self, filename):
         """
-        Load a .dat/.npy/.mtx file, it's .set file if present, update the GUI elements,
-        and fire an on_data_change event to update the plots.
+        Load a .dat/.npy/.mtx file and it's .set file if present in a background thread.
+        When it is loaded (on_file_loaded), update the GUI elements and fire an
+        on_data_change event to update the plots. A file which is still being loaded is
+        cancelled, unless it is the same file, which is then refreshed afterwards.
         """
-        t0 = time()
-        is_new_filename = self.dat_file.update_file(filename)
+        if self.file_loader is not None:
+            if self.file_loader.filename == filename:
+                self.file_loader.reload = True
+                return
+            self.file_loader.cancel()
+            self.file_loader = None
+        if filename != self.dat_file.filename and self.prefetcher is not None:
+            self.prefetcher.cancel()# the prefetcher is started again when the file is shown
+            self.prefetcher = None
+        self.t_load = time()
+        self.cb_indices = [cb.currentIndex() for cb in self.combo_boxes]
+        if filename == self.dat_file.filename:
+            dat_file = self.dat_file.copy()# refresh, the current one is still shown
+        else:
+            dat_file = DatFile(self)
+            if dat_file.is_in_dataset_cache(filename):
+                dat_file.update_file(filename)# no need for a thread
+                self.show_dat_file(dat_file, filename, True)
+                return
+        loader = Loader(lambda loader: dat_file.update_file(filename, loader.report), self)
+        loader.filename = filename
+        loader.reload = False
+        loader.progress.connect(self.l_progress.setText)
+        loader.done.connect(lambda result, error: self.on_file_loaded(loader, dat_file, result, error))
+        self.file_loader = loader
+        self.l_progress.setText('Loading')
+        loader.start()
+
+    def is_loading(self):
+        """ Whether a file is being loaded or data is being processed in the background. """
+        return self.file_loader is not None or self.data_loader is not None
+
+    def on_file_loaded(self, loader, dat_file, is_new_filename, error):
+        """ Swap in the DatFile loaded by load_dat_file. """
+        if loader is not self.file_loader:
+            return# cancelled
+        self.file_loader = None
+        if error is not None:
+            logger.error('Failed to load %s: %s' % (loader.filename, error))
+            self.l_progress.setText('Failed')
+            self.t_load = None
+            return
+        self.show_dat_file(dat_file, loader.filename, is_new_filename)
+        if loader.reload:
+            self.load_dat_file(loader.filename)
+
+    def show_dat_file(self, dat_file, filename, is_new_filename):
+        """ Make dat_file the current DatFile, update the GUI and plot it. """
+        self.dat_file = dat_file
+        if len(self.dat_file.shape) == 3:
+            if self.dat_file.shape[2]>1:
+                self.cb_a3.setStyleSheet("background-color:#cfc;")
+            else:
+                self.cb_a3.setStyleSheet("background-color:#eee;")
         if is_new_filename:
             self.settings.fill_tree()
             path, self.name = os.path.split(filename)
             self.filename = filename
             self.abs_filename = os.path.abspath(filename)
             self.open_state(self.profile_ini_file,changeValue=self.is_first_data_file)
+            self.prefetch(filename)
         else:
             self.on_data_change()
-        t2 = time()
-        ld_time = (t2-t0)*1000
-        self.max_load_time = max(self.max_load_time,ld_time)
-        self.load_time.setText('%d (%d) ms'%(ld_time,self.max_load_time))
+        if self.dat_file.data is not None:
+            self.l_progress.setText('%d rows' % self.dat_file.data.shape[0])
+        else:
+            self.l_progress.setText('No data')
+        self.l_cache.setText('%d/%d' % (self.dataset_cache.hits, self.dataset_cache.misses))
+
+    def prefetch(self, filename):
+        """
+        Load the next and previous self.n_prefetch files of a numbered sequence
+        (see Canvas.loadNext) into the dataset cache in a background thread.
+        """
+        if self.prefetcher is not None:
+            self.prefetcher.cancel()
+            self.prefetcher = None
+        filenames = []
+        for i in range(1, self.n_prefetch+1):
+            for inc in (i, -i):
+                name = get_next_filename(os.path.abspath(filename), inc)
+                if name is not None and os.path.isfile(name):
+                    filenames.append(name)
+        if not filenames:
+            return
+
+        def job(loader):
+            for name in filenames:
+                loader.check()
+                dat_file = DatFile(self)
+                if not dat_file.is_in_dataset_cache(name):
+                    dat_file.update_file(name, loader.report)# puts it in the dataset cache
+
+        self.prefetcher = Loader(job, self)
+        self.prefetcher.start()
         
     def update_parameters(self):
         pass
@@ -581,7 +698,8 @@ class QTPlot(QtGui.QMainWindow):
             ('line_width', str(self.linecut.le_linewidth.text())),
             ('marker_style', str(self.linecut.cb_markerstyle.currentText())),
             ('marker_size', str(self.linecut.le_markersize.text())),
-            ('incl_z', self.linecut.cb_include_z.isChecked())
+            ('incl_z', self.linecut.cb_include_z.isChecked()),
+            ('precision', self.profile_settings.get('precision', PROFILE_DEFAULTS['precision']))
         ))
 
         for option, value in state.items():
@@ -627,18 +745,29 @@ class QTPlot(QtGui.QMainWindow):
 
         self.update_ui(changeValue)
         self.on_cmap_change(update_canvas=False)# should only update the canvas once
-        self.on_data_change()
+        self.on_data_change()# also updates the export tab
         
         if changeValue:
             self.export_widget.populate_ui()
             self.linecut.populate_ui()
 
-        # If we are viewing the export tab, update the plot
-        if self.main_widget.currentIndex() == 1:
-            self.export_widget.on_update()
-
     def get_parameter_names(self):
         return self.dat_file.ids
+
+    def get_used_parameters(self, ids):
+        """
+        Names of the parameters in ids which will be used when a new data file with these
+        parameters is loaded, None if unknown. The combo boxes keep their indexes. Called
+        from the loading thread, so the indexes are read in load_dat_file.
+        """
+        if self.is_first_data_file:
+            return None
+        names = [self.profile_settings['sub_series_V'], self.profile_settings['sub_series_I']]
+        for i in self.cb_indices:
+            i -= 1
+            if 0 <= i < len(ids):
+                names.append(ids[i])
+        return names
     
     def get_a3(self):
         a3 = self.cb_a3.currentIndex()-1
@@ -657,12 +786,13 @@ class QTPlot(QtGui.QMainWindow):
         consist of a new data file being loaded, a change in parameter to plot,
         or a change/addition of an Operation.
 
-        A clean version of the Data2D is retrieved from the DatFile,
-        all the operations are applied to the data, and it is plotted.
+        A clean version of the Data2D is retrieved from the DatFile and all the
+        operations are applied to the data in a background thread, then it is
+        plotted by on_data_ready.
         """
-        self.canvas.clear()
         # Get the selected axes from the interface
         if self.filename is None or not os.path.isfile(self.filename):
+            self.canvas.clear()
             return
         x_name, y_name, data_name = self.get_axis_names()
         # Update the Data2D
@@ -684,13 +814,38 @@ class QTPlot(QtGui.QMainWindow):
         else:
             self.cb_x.setEnabled(True)
             self.cb_y.setEnabled(True)
-        self.data = self.dat_file.get_data(x_name,y_name,data_name,a3,a3index) # return Data2D object
-        if self.data is None:
+        queue = self.operations.get_queue()
+        dat_file = self.dat_file
+        dtype = np.float32 if self.profile_settings.get('precision', PROFILE_DEFAULTS['precision']) == 'float32' else np.float64
+
+        def job(loader):
+            data = dat_file.get_data(x_name,y_name,data_name,a3,a3index,dtype) # return Data2D object
+            if data is None:
+                return None
+            # Apply the selected operations
+            key = (id(dat_file), dat_file.version, x_name, y_name, data_name, a3, a3index, np.dtype(dtype).str)
+            return self.operations.run_queue(data, queue, loader.check, key)
+
+        if self.data_loader is not None:
+            self.data_loader.cancel()
+        loader = Loader(job, self)
+        loader.done.connect(lambda result, error: self.on_data_ready(loader, result, error))
+        self.data_loader = loader
+        loader.start()
+
+    def on_data_ready(self, loader, result, error):
+        """ Plot the data processed by on_data_change. """
+        if loader is not self.data_loader:
+            return# superseded by a newer on_data_change
+        self.data_loader = None
+        if result is None:
+            self.data = None
+            self.canvas.clear()
             return
-            
-        # Apply the selected operations
-        self.data = self.operations.apply_operations(self.data)
-        
+        self.data, self.operations.op_str, updates = result
+        # Show the parameters which were determined from the data
+        for op, name, value in updates:
+            op.set_parameter(name, value)
 
         # If we want to reset the colormap for each data update, do so
         if self.cb_reset_cmap.checkState() == QtCore.Qt.Checked:
@@ -700,9 +855,35 @@ class QTPlot(QtGui.QMainWindow):
         # Update the linecut
         self.canvas.draw_linecut(None, old_position=True)
 
+        # If we are viewing the export tab, update the plot
+        if self.main_widget.currentIndex() == 1:
+            self.export_widget.on_update()
+
+        if self.t_load is not None:
+            ld_time = (time()-self.t_load)*1000
+            self.t_load = None
+            self.max_load_time = max(self.max_load_time,ld_time)
+            self.load_time.setText('%d (%d) ms'%(ld_time,self.max_load_time))
+
         #if np.isnan(self.data.z).any():
             #logger.warning('The data contains NaN values')
 
+    def triangulate(self, data):
+        """ Triangulate data in a background thread, then draw the linecut again. """
+        if self.triangulator is not None and self.triangulator.data is data:
+            return
+        loader = Loader(lambda loader: data.generate_triangulation(), self)
+        loader.data = data
+        loader.done.connect(lambda result, error: self.on_triangulated(loader, error))
+        self.triangulator = loader
+        loader.start()
+
+    def on_triangulated(self, loader, error):
+        if loader is self.triangulator:
+            self.triangulator = None
+        if error is None and loader.data is self.canvas.data and self.canvas.line_type == 'diagonal':
+            self.canvas.draw_linecut(None, old_position=True)
+
     def get_axis_names(self):
         """ Get the parameters that are currently selected to be plotted """
         self.x_name = str(self.cb_x.currentText())
@@ -781,7 +962,7 @@ class QTPlot(QtGui.QMainWindow):
 
     def on_min_max_entered(self, update_canvas=True):
         if self.data is not None:
-            zmin, zmax = np.nanmin(self.data.z), np.nanmax(self.data.z)
+            zmin, zmax = self.data.get_stats().get_min_max()
 
             newmin = float(self.le_min.text())
             newmax = float(self.le_max.text())
@@ -798,7 +979,7 @@ class QTPlot(QtGui.QMainWindow):
     
     def on_min_changed(self, value, update_canvas=True):
         if self.data is not None:
-            min, max = np.nanmin(self.data.z), np.nanmax(self.data.z)
+            min, max = self.data.get_stats().get_min_max()
 
             newmin = min + (max - min) * (value / 99.0)
             self.le_min.setText('%.2e' % newmin)
@@ -823,7 +1004,7 @@ class QTPlot(QtGui.QMainWindow):
 
     def on_max_changed(self, value, update_canvas=True):
         if self.data is not None:
-            min, max = np.nanmin(self.data.z), np.nanmax(self.data.z)
+            min, max = self.data.get_stats().get_min_max()
 
             # This stuff with the 99 is hacky, something is going on which
             # causes the highest values not to be rendered using the colormap.
@@ -906,12 +1087,16 @@ class QTPlot(QtGui.QMainWindow):
         self.operations.close()
         self.settings.close()
         self.qpServer.deleteLater()
+        for loader in self.findChildren(Loader):
+            loader.cancel()
+            loader.wait()
         del self.dat_file.data # data may be a mmap
         self.closed = True
 
 
 
 def main():
+    multiprocessing.freeze_support()# the parser starts worker processes
     app = QtGui.QApplication(sys.argv)
     if len(sys.argv) > 1 and os.path.isfile(sys.argv[1]):
         QTPlot(filename=sys.argv[1])
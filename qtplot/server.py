@@ -19,16 +19,23 @@ class qpServer(QtCore.QObject):
         self.client.readyRead.connect(self.on_ready_read)
         self.client.disconnected.connect(self.client.deleteLater)
     def on_ready_read(self):
-        msg = self.client.readAll().data()
+        client = self.client
+        msg = client.readAll().data()
         if msg != '':
-            msg_return = self.handle_remote_msg(msg)
-            if msg_return:
-                self.client.write(msg_return)
-        self.client.disconnectFromHost()
-    def handle_remote_msg(self,msg):
-        cmd = msg.split(';')
-        msg_return = ''
-        for i in cmd:
+            self.handle_remote_msg(client, msg.split(';'), '')
+        else:
+            client.disconnectFromHost()
+    def handle_remote_msg(self, client, cmd, msg_return):
+        """
+        Handle the commands cmd in order, then reply to client. Files and data are
+        loaded in background threads, so the commands after one which loads, and the
+        reply, wait until the loading is done.
+        """
+        while cmd or self.main.is_loading():
+            if self.main.is_loading():
+                QtCore.QTimer.singleShot(50, lambda: self.handle_remote_msg(client, cmd, msg_return))
+                return
+            i = cmd.pop(0)
             try:
                 key,value = i.split(':',1)
                 if key == 'FILE':
@@ -71,4 +78,6 @@ class qpServer(QtCore.QObject):
             except:
                 msg_return +=  'Unknown msg:%s;'%i
         msg_return = 'qtplot:'+msg_return if msg_return != '' else ''
-        return msg_return
+        if msg_return:
+            client.write(msg_return)
+        client.disconnectFromHost()
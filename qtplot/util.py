@@ -25,6 +25,64 @@ def eng_format(number, significance):
     return ('%s' + format + '%s') % (sign, x3, exp3_text)
 
 
+def get_next_filename(filename, inc=1):
+    """
+    Return the name of a numbered .dat file with its number changed by inc
+    (dev8_930.dat -> dev8_931.dat), or None if it is not numbered.
+    """
+    if filename and filename.endswith('.dat'):
+        _ = filename[:-4]
+        for i in range(len(_)-1,-1,-1):
+            if not _[i:].isdigit():
+                break
+        if i == 0:
+            i = -1
+        if i != len(_)-1:
+            fileCount = int(_[i+1:])+inc
+            return _[:i+1]+str(fileCount)+'.dat'
+    return None
+
+
+def interp_rows(x, y, x_new):
+    """
+    Linear interpolation of every row of y(x) at the increasing points x_new. The
+    same as interp1d(x[i], y[i], bounds_error=False, fill_value=np.nan)(x_new) for
+    every row i, but without a Python loop: NaN outside of the range of a row.
+    """
+    x, y, x_new = np.asarray(x), np.asarray(y), np.asarray(x_new)
+    if not issubclass(y.dtype.type, np.inexact):
+        y = y.astype(np.float64)
+    n, m = x.shape
+    k = len(x_new)
+    if m < 2:
+        raise ValueError('x and y arrays must have at least 2 entries')
+    rows = np.arange(n)[:,np.newaxis]
+
+    # Sort every row by x, usually they are sorted already
+    if not (np.diff(x, axis=1) >= 0).all():
+        order = np.argsort(x, axis=1, kind='mergesort')
+        x, y = x[rows, order], y[rows, order]
+
+    # Vectorized searchsorted(x[i], x_new): x[i,l] < x_new[j] for j >= p[i,l], so
+    # the number of x smaller than x_new[j] is a cumulative count of p per row.
+    p = np.searchsorted(x_new, x, side='right') + rows*(k + 1)
+    counts = np.bincount(p.ravel(), minlength=n*(k + 1)).reshape(n, k + 1)
+    indices = np.cumsum(counts[:,:k], axis=1).clip(1, m - 1)
+
+    # Gather the neighbours by flat indices, faster than 2d fancy indexing
+    x, y = np.ascontiguousarray(x).ravel(), np.ascontiguousarray(y).ravel()
+    lo = indices - 1 + rows*m
+    hi = lo + 1
+    x_lo, x_hi = x.take(lo), x.take(hi)
+    y_lo, y_hi = y.take(lo), y.take(hi)
+    slope = (y_hi - y_lo) / (x_hi - x_lo)
+    y_new = slope*(x_new - x_lo) + y_lo
+
+    first, last = x[rows*m], x[rows*m + m - 1]
+    y_new[(x_new < first) | (x_new > last)] = np.nan
+    return y_new
+
+
 class FixedOrderFormatter(ScalarFormatter):
     """Format numbers
         %.f: engineering notation
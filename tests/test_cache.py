@@ -0,0 +1,38 @@
+import os
+
+from qtplot.cache import MemoryCache, file_key
+
+
+def test_memory_cache_lru():
+    cache = MemoryCache(max_size=1e-5)# 10 bytes
+    cache.put('a', 1, 4)
+    cache.put('b', 2, 4)
+    assert cache.get('a') == 1# now the most recently used
+
+    # The least recently used value is evicted
+    cache.put('c', 3, 4)
+    assert 'b' not in cache and 'a' in cache and 'c' in cache
+    assert cache.nbytes == 8
+
+    # Replaced, and too large values are not stored
+    cache.put('a', 4, 2)
+    cache.put('d', 5, 11)
+    assert cache.get('a') == 4 and cache.get('d') is None
+    assert cache.nbytes == 6
+    assert (cache.hits, cache.misses) == (2, 1)
+
+    cache.clear()
+    assert cache.get('a') is None and cache.nbytes == 0
+
+
+def test_file_key(tmpdir):
+    path = str(tmpdir.join('a.dat'))
+    with open(path, 'w') as f:
+        f.write('1\t2\n')
+    key = file_key(path)
+    assert file_key(path) == key
+
+    # A prefetched file which changed since is not used
+    st = os.stat(path)
+    os.utime(path, (st.st_atime, st.st_mtime + 10))
+    assert file_key(path) != key
@@ -0,0 +1,122 @@
+import numpy as np
+import numpy.testing as npt
+
+from qtplot.canvas import Canvas
+from qtplot.data import Data2D, DatFile
+
+from test_colormap import make_colormap
+from test_datfile import HEADER, Main, write
+from test_operations import Op, make_operations
+
+
+class Texture:
+    """ Records the values uploaded by Canvas.update_values """
+    def __init__(self):
+        self.uploads = []
+
+    def set_data(self, data):
+        self.uploads.append(np.array(data))
+
+
+def make_canvas(data):
+    # The state of set_data for a grid, without an OpenGL context
+    canvas = Canvas.__new__(Canvas)
+    canvas.data = data
+    canvas.coords = data.x, data.y
+    canvas.mode = 'grid'
+    canvas.values_index = (slice(None), slice(None))
+    canvas.values_texture = Texture()
+    return canvas
+
+
+def test_update_values(tmpdir):
+    path = tmpdir.join('a.dat')
+    write(path, HEADER + '0\t0\t-1\n1\t0\t2\n2\t0\t-3\n0\t1\t4\n1\t1\t-5\n2\t1\t6\n')
+    dat_file = DatFile(Main())
+    dat_file.update_file(str(path))
+    operations = make_operations()
+
+    def run(queue):
+        data = dat_file.get_data('x', 'y', 'z', 2, 0)
+        key = (id(dat_file), dat_file.version, 'x', 'y', 'z', 2, 0)
+        return operations.run_queue(data, queue, None, key)[0]
+
+    canvas = make_canvas(run([]))
+
+    # Toggling an elementwise operation of the values only uploads them
+    result = run([(Op(Data2D.abs), {})])
+    assert canvas.update_values(result)
+    npt.assert_array_equal(canvas.values_texture.uploads[-1], [[1, 2, 3], [4, 5, 6]])
+    canvas.data = result
+
+    result = run([])
+    assert canvas.update_values(result)
+    npt.assert_array_equal(canvas.values_texture.uploads[-1], [[-1, 2, -3], [4, -5, 6]])
+    canvas.data = result
+
+    # New coordinates need new geometry
+    offset = (Op(Data2D.offset), {'x_offset': 1., 'y_offset': 0., 'z_offset': 0.})
+    assert not canvas.update_values(run([offset]))
+
+
+def grid_canvas(max_texture_size=2048):
+    canvas = Canvas.__new__(Canvas)
+    canvas.max_texture_size = max_texture_size
+    return canvas
+
+
+def grid_data(x, y):
+    x, y = np.meshgrid(x, y)
+    return Data2D(x, y, x * y, np.zeros(x.shape))
+
+
+def test_generate_grid():
+    data = grid_data(np.linspace(0, 1, 11), np.linspace(-1, 1, 5))
+    edges, (rows, columns) = grid_canvas().generate_grid(data)
+    npt.assert_allclose(edges, (-0.05, 1.05, -1.25, 1.25))
+    assert (rows, columns) == (slice(0, 5), slice(0, 11))
+
+    # Uneven spacing and more values than texels are drawn as a mesh
+    assert grid_canvas().generate_grid(grid_data(np.linspace(0, 1, 11) ** 2, [0, 1])) is None
+    assert grid_canvas(10).generate_grid(data) is None
+
+
+def triangles(positions, indices):
+    """ The sorted corners of every triangle, without the degenerate ones """
+    corners = positions[indices].reshape(-1, 3, 2).tolist()
+    return sorted(sorted(map(tuple, t)) for t in corners if len(set(map(tuple, t))) == 3)
+
+
+def test_generate_mesh():
+    rs = np.random.RandomState(0)
+    data = grid_data(np.linspace(0, 1, 5) ** 2, np.linspace(-1, 1, 4))
+    data.x = data.x + 0.01 * rs.randn(*data.x.shape)
+    vertex_data, indices = grid_canvas().generate_mesh(data)
+
+    # The triangle strip covers the same triangles as the separate triangles
+    strip = np.array([indices[i:i+3] for i in range(len(indices) - 2)]).ravel()
+    positions = vertex_data['a_position']
+    expected = grid_canvas().generate_vertices(data)['a_position']
+    expected = triangles(expected, np.arange(len(expected)))
+    assert len(expected) == 2 * 4 * 5
+    assert triangles(positions, strip) == expected
+    assert len(vertex_data) == 6 * 5
+
+    # The index of the value of every corner
+    npt.assert_array_equal(vertex_data['a_index'][:6], [[0, 0], [1, 0], [2, 0], [3, 0], [4, 0], [5, 0]])
+    assert grid_canvas(4).generate_mesh(data) is None
+
+
+def test_colormap_texture(tmpdir):
+    canvas = Canvas.__new__(Canvas)
+    canvas.colormap = make_colormap(tmpdir)
+    canvas.cmap_texture = Texture()
+    canvas.cmap_colors = canvas.colormap.get_colors()
+
+    # Uploaded only when the gamma changed the colors
+    assert canvas.get_colormap_texture() is canvas.cmap_texture
+    assert canvas.cmap_texture.uploads == []
+    canvas.colormap.gamma = 2
+    canvas.get_colormap_texture()
+    canvas.get_colormap_texture()
+    assert len(canvas.cmap_texture.uploads) == 1
@@ -0,0 +1,25 @@
+import numpy as np
+import numpy.testing as npt
+
+from qtplot.colormap import Colormap
+
+
+def make_colormap(tmpdir):
+    path = str(tmpdir.join('cmap.txt'))
+    np.savetxt(path, [[0, 0, 255], [255, 0, 0], [255, 255, 255]], fmt='%d')
+    return Colormap(path)
+
+
+def test_get_colors(tmpdir):
+    colormap = make_colormap(tmpdir)
+    colors = colormap.get_colors()
+    npt.assert_array_equal(colors, [[0, 0, 255], [255, 0, 0], [255, 255, 255]])
+    assert not colors.flags.writeable
+
+    # Cached until the gamma changes
+    assert colormap.get_colors() is colors
+    colormap.gamma = 2
+    gamma_colors = colormap.get_colors()
+    assert gamma_colors is not colors
+    npt.assert_array_equal(gamma_colors, [[0, 0, 255], [127, 0, 127], [255, 255, 255]])
+    assert colormap.get_colors() is gamma_colors
@@ -0,0 +1,139 @@
+import numpy as np
+import numpy.testing as npt
+
+from qtplot.cache import MemoryCache
+from qtplot.data import Data2D, SortedIndex, histogram_columns
+
+
+def histogram_loop(z, min, max, bins):
+    return np.array([np.histogram(z[:,j], bins, (min, max))[0]
+                     for j in range(z.shape[1])]).T
+
+
+def test_histogram_columns():
+    z = np.random.RandomState(0).normal(size=(500, 7))
+    z[::3, 2] = np.nan
+    # Values on the edges of the bins and outside of the range
+    z[:11, 4] = np.linspace(-1, 1, 11)
+    z[:, 5] = 0.5
+
+    for min, max, bins in [(-1, 1, 10), (np.nanmin(z), np.nanmax(z), 37), (0.5, 0.5, 3)]:
+        expected = histogram_loop(z, min, max, bins)
+        npt.assert_array_equal(histogram_columns(z, min, max, bins), expected)
+        # Blocks of a few rows
+        npt.assert_array_equal(histogram_columns(z, min, max, bins, 20), expected)
+
+
+def test_histogram_columns_float32():
+    z = np.random.RandomState(1).uniform(-2, 2, (300, 5)).astype(np.float32)
+    z[:, 3] = np.float32(0.1)
+    for min, max in [(z.min(), z.max()), (-1, 1), (np.float32(0.1), np.float32(0.1))]:
+        npt.assert_array_equal(histogram_columns(z, min, max, 25),
+                               histogram_loop(z, min, max, 25))
+
+
+def make_data():
+    x, y = np.meshgrid(np.linspace(0, 1, 4), np.linspace(2, 3, 3))
+    z = np.arange(12.).reshape(3, 4)
+    return Data2D(x, y, z, np.arange(12.).reshape(3, 4))
+
+
+def test_copy_on_write():
+    data = make_data()
+    copy = data.copy()
+    # The arrays are shared and read-only
+    for name in ('x', 'y', 'z', 'row_numbers'):
+        assert getattr(copy, name) is getattr(data, name)
+        assert not getattr(data, name).flags.writeable
+
+    # Only the arrays which are modified are copied, once
+    copy.own('z')
+    z = copy.z
+    assert z is not data.z and z.flags.writeable
+    copy.own('z')
+    assert copy.z is z
+    copy.z *= 2
+    assert copy.x is data.x
+    npt.assert_array_equal(data.z, np.arange(12.).reshape(3, 4))
+
+    # A copy of the copy shares its private array again
+    again = copy.copy()
+    assert again.z is z and not z.flags.writeable
+    copy.own('z')
+    assert copy.z is not z
+
+    # Operations copy only the arrays they modify
+    copy = data.copy()
+    copy.offset(z_offset=1)
+    assert copy.x is data.x and copy.y is data.y and copy.z is not data.z
+    npt.assert_array_equal(copy.z, data.z + 1)
+
+
+def test_triangulation_cache(monkeypatch):
+    monkeypatch.setattr(Data2D, 'triangulations', MemoryCache(10))
+    data = make_data()
+    key = data.get_triangulation_key()
+    assert data.generate_triangulation()
+    tri = data.tri
+
+    # Equal coordinates and NaN: the same triangulation, whatever the values
+    other = make_data()
+    other.z = other.z * 2
+    assert other.get_triangulation_key() == key
+    assert other.generate_triangulation(cached_only=True)
+    assert other.tri is tri
+    npt.assert_array_equal(other.no_nan_values, 2 * data.z.ravel())
+
+    # New NaN or moved coordinates are triangulated again
+    other.own('z')
+    other.z[1, 2] = np.nan
+    assert other.get_triangulation_key() != key
+    assert not other.generate_triangulation(cached_only=True)
+    other = make_data()
+    other.own('x')
+    other.x[0, 0] = -0.1
+    assert other.get_triangulation_key() != key
+
+
+def test_sorted_index():
+    rs = np.random.RandomState(2)
+    values = np.round(rs.uniform(-5, 5, 200), 1)# with equal values
+    values[::13] = np.nan
+    index = SortedIndex(values)
+    for value in np.concatenate((rs.uniform(-6, 6, 300), values[1:13])):
+        # The same as the linear search it replaces
+        expected = np.nanargmin(np.abs(values - value))
+        assert index.nearest(value) == expected
+
+    assert SortedIndex(np.array([np.nan, np.nan])).nearest(1) == 0
+
+
+def test_closest():
+    data = make_data()
+    assert data.get_closest_x(0.4) == data.x[0, 1]
+    assert data.get_closest_y(2.9) == 3
+    _, z, _, index = data.get_column_at(0.9)
+    assert index == 3
+    npt.assert_array_equal(z, data.z[:, 3])
+
+
+def test_array_stats():
+    data = make_data()
+    data.z[0, 0] = np.nan
+    stats = data.get_stats()
+    assert stats.get_min_max() == (1, 11)
+    assert stats.get_nan_count() == 1
+    assert stats.get_percentile(50) == np.nanpercentile(data.z, 50)
+    counts, edges = stats.get_histogram(5)
+    npt.assert_array_equal(counts, np.histogram(data.z[1:].ravel(), 5, (1, 11))[0] +
+                           np.histogram(data.z[0, 1:], 5, (1, 11))[0])
+    assert data.get_stats() is stats
+    x_stats = data.get_stats('x')
+
+    # Computed again after an operation changes z, in place or not
+    data.offset(z_offset=1)
+    assert data.get_stats().get_min_max() == (2, 12)
+    data.z = data.z * 2
+    assert data.get_limits()[4:] == (4, 24)
+    # x didn't change
+    assert data.get_stats('x') is x_stats
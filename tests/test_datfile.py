@@ -0,0 +1,219 @@
+import numpy as np
+import numpy.testing as npt
+
+from qtplot.cache import MemoryCache, ParseCache
+from qtplot.data import DatFile
+
+equal = npt.assert_array_equal
+
+HEADER = ('# Filename: a.dat\n# Timestamp: x\n\n'
+          '# Column 1:\n#\tname: x\n#\tsize: 3\n'
+          '# Column 2:\n#\tname: y\n#\tsize: 2\n'
+          '# Column 3:\n#\tname: z\n\n')
+
+
+class Main:
+    """ The settings of QTPlot which are used by DatFile """
+    def __init__(self, memory_cache_size=0):
+        self.parse_cache = None
+        self.lazy_columns = False
+        self.parse_workers = 1
+        self.dataset_cache = MemoryCache(memory_cache_size)
+
+
+def write(path, text, mode='w'):
+    with open(str(path), mode) as f:
+        f.write(text)
+
+
+def load(path, main=None):
+    d = DatFile(main or Main())
+    d.update_file(str(path))
+    return d
+
+
+def test_append(tmpdir):
+    path = tmpdir.join('a.dat')
+    # The last line is incomplete, it is parsed when it is finished
+    write(path, HEADER + '0\t0\t1\n1\t0\t2\n2\t0\t3\n\n0\t1\t4\n1\t1')
+    d = load(path)
+    equal(d.data[:, 2], [1, 2, 3, 4])
+
+    starts = []
+    parse_rows = d.parse_rows
+    def spy(f, start, end, usecols=None):
+        starts.append(start)
+        return parse_rows(f, start, end, usecols)
+    d.parse_rows = spy
+
+    write(path, '\t5\n2\t1\t6\n', 'a')
+    d.update_file(str(path))
+    equal(d.data[:, 2], [1, 2, 3, 4, 5, 6])
+    # Only the appended lines are parsed
+    assert len(starts) == 1 and starts[0] > len(HEADER)
+
+    version = d.version
+    d.update_file(str(path))
+    equal(d.data[:, 2], [1, 2, 3, 4, 5, 6])
+    assert d.version == version + 1
+
+
+def test_rewrite(tmpdir):
+    path = tmpdir.join('a.dat')
+    write(path, HEADER + '0\t0\t1\n1\t0\t2\n2\t0\t3\n')
+    d = load(path)
+
+    # Same size, different content: parsed again from the start
+    write(path, HEADER + '0\t0\t7\n1\t0\t8\n2\t0\t9\n')
+    d.update_file(str(path))
+    equal(d.data[:, 2], [7, 8, 9])
+
+    # Truncated
+    write(path, HEADER + '9\t9\t9\n')
+    d.update_file(str(path))
+    equal(d.data, [[9, 9, 9]])
+
+
+def test_dataset_cache(tmpdir):
+    path = tmpdir.join('a.dat')
+    write(path, HEADER + '0\t0\t1\n1\t0\t2\n2\t0\t3\n')
+    main = Main(memory_cache_size=10)
+    d = load(path, main)
+    nbytes = main.dataset_cache.nbytes
+
+    # Changes of the live DatFile don't reach the cached state
+    d.set_column('z', [4, 5, 6])
+    d.set_column('w', np.zeros(3))
+    assert main.dataset_cache.nbytes == nbytes
+
+    e = load(path, main)
+    assert main.dataset_cache.hits == 1
+    assert e.ids == ['x', 'y', 'z']
+    equal(e.data[:, 2], [1, 2, 3])
+    equal(d.data[:, 2], [4, 5, 6])
+
+
+def test_set_column_copies_shared_data(tmpdir):
+    path = tmpdir.join('a.dat')
+    write(path, HEADER + '0\t0\t1\n1\t0\t2\n2\t0\t3\n')
+    d = load(path)
+    e = d.copy()
+
+    # The shared data is copied once, then written in place
+    e.set_column('z', [4, 5, 6])
+    data = e.data
+    e.set_column('x', [7, 8, 9])
+    assert e.data is data
+    equal(e.data, [[7, 0, 4], [8, 0, 5], [9, 0, 6]])
+    equal(d.data, [[0, 0, 1], [1, 0, 2], [2, 0, 3]])
+
+
+def test_get_data_same_arrays(tmpdir):
+    path = tmpdir.join('a.dat')
+    write(path, HEADER + '0\t0\t1\n1\t0\t2\n2\t0\t3\n0\t1\t4\n1\t1\t5\n2\t1\t6\n')
+    d = load(path)
+
+    first = d.get_data('x', 'y', 'z', 2, 0)
+    second = d.get_data('x', 'y', 'z', 2, 0)
+    assert second is not first
+    assert second.x is first.x and second.y is first.y and second.z is first.z
+    # Shared arrays are read-only, operations copy them before modifying them
+    assert not second.z.flags.writeable
+
+    assert d.get_data('x', 'y', 'z', 2, 0, np.float32).z is not first.z
+    d.update_file(str(path))
+    assert d.get_data('x', 'y', 'z', 2, 0).x is not first.x
+
+
+def write_mtx(path, values):
+    nx, ny, nz = values.shape
+    with open(str(path), 'wb') as f:
+        f.write(b'Units, v, x, 0, 2, y, 0, 1, z, 0, 0\n')
+        f.write(('%d %d %d 8\n' % (nx, ny, nz)).encode('ascii'))
+        f.write(values.astype(np.float64).tobytes())
+
+
+def test_mtx_derived_column(tmpdir):
+    path = tmpdir.join('a.mtx')
+    values = np.arange(6.).reshape((3, 2, 1), order='F')
+    write_mtx(path, values)
+    d = load(path)
+
+    v = d.get_column('v')
+    d.set_column('v - Sub series R', v - 2 * d.get_column('x'))
+    assert d.ids == d.labels == ['x', 'y', 'z', 'v', 'v - Sub series R']
+
+    data = d.get_data('x', 'y', 'v - Sub series R', 2, 0)
+    equal(data.z, [[0, -1, -2], [3, 2, 1]])
+    equal(d.get_data('x', 'y', 'v', 2, 0).z, [[0, 1, 2], [3, 4, 5]])
+    assert list(d.get_row_info(4).values()) == [1, 1, 0, 4, 2]
+
+
+def test_get_data_views(tmpdir):
+    path = tmpdir.join('a.mtx')
+    write_mtx(path, np.arange(6.).reshape((3, 2, 1), order='F'))
+    d = load(path)
+    assert np.shares_memory(d.get_data('x', 'y', 'v', 2, 0).z, d.data.values)
+
+    # A complete page of a text file
+    path = tmpdir.join('a.dat')
+    write(path, HEADER + '0\t0\t.5\n1\t0\t2\n2\t0\t3\n0\t1\t4\n1\t1\t5\n2\t1\t6\n')
+    d = load(path)
+    assert np.shares_memory(d.get_data('x', 'y', 'z', 2, 0).z, d.data)
+
+
+def test_parse_cache(tmpdir, monkeypatch):
+    monkeypatch.setattr(ParseCache, 'MIN_FILE_SIZE', 0)
+    monkeypatch.setattr(ParseCache, 'MIN_FILE_AGE', 0)
+    path = tmpdir.join('a.dat')
+    write(path, HEADER + '0\t0\t1\n1\t0\t2\n2\t0\t3\n')
+    main = Main()
+    main.parse_cache = ParseCache(str(tmpdir.join('cache')), 10)
+    load(path, main)
+
+    # Loaded again from the cache without parsing
+    d = DatFile(main)
+    d.parse_rows = None
+    d.update_file(str(path))
+    assert isinstance(d.data, np.memmap)
+    equal(d.data[:, 2], [1, 2, 3])
+
+    # Appended lines are parsed after the cached ones
+    del d.parse_rows
+    write(path, '0\t1\t4\n', 'a')
+    d.update_file(str(path))
+    equal(d.data[:, 2], [1, 2, 3, 4])
+
+
+def test_lazy_columns(tmpdir):
+    path = tmpdir.join('a.dat')
+    write(path, HEADER + '0\t0\t1\n1\t0\t2\n2\t0\t3\n')
+    main = Main()
+    main.lazy_columns = True
+    main.get_used_parameters = lambda ids: ['z', 'x']
+    d = load(path, main)
+
+    # Only the used columns are parsed on load, the others on first use
+    assert d.data_columns == [0, 2]
+    equal(d.data, [[0, 1], [1, 2], [2, 3]])
+    equal(d.get_column('y'), [0, 0, 0])
+    assert list(d.get_row_info(1).values()) == [1, 0, 2]
+
+    # Appended lines include the columns parsed later
+    write(path, '0\t1\t4\n', 'a')
+    d.update_file(str(path))
+    equal(d.get_column('z'), [1, 2, 3, 4])
+    equal(d.get_column('y'), [0, 0, 0, 1])
+
+
+def test_get_data_float32(tmpdir):
+    path = tmpdir.join('a.dat')
+    write(path, HEADER + '0.1\t0\t.1\n1.1\t0\t2\n2.1\t0\t3\n0.1\t1e-9\t4\n1.1\t1e-9\t5\n')
+    d = load(path)
+
+    # Only the values are float32, the coordinates keep their precision
+    data = d.get_data('x', 'y', 'z', 2, 0, np.float32)
+    assert data.z.dtype == np.float32
+    assert data.x.dtype == data.y.dtype == np.float64
+    equal(data.y[1, :2], 1e-9)
+    equal(data.z, np.array([[.1, 2, 3], [4, 5, np.nan]], np.float32))
@@ -0,0 +1,57 @@
+import numpy as np
+import numpy.testing as npt
+from scipy import ndimage
+
+from qtplot import filters
+
+
+def random_values(shape=(60, 80)):
+    return np.random.RandomState(0).randn(*shape)
+
+
+def test_convolve():
+    z = random_values()
+    # Direct, separable (gaussian) and FFT (lorentzian) convolution
+    for x_dev, y_dev, distr in [(0.5, 0.5, 'gaussian'), (4, 3, 'gaussian'),
+                                (3, 2, 'exponential'), (6, 4, 'lorentzian')]:
+        kernel = filters.create_kernel(x_dev, y_dev, 7, distr)
+        npt.assert_allclose(filters.convolve(z, x_dev, y_dev, 7, distr),
+                            ndimage.convolve(z, kernel), rtol=1e-10, atol=1e-12)
+
+
+def test_convolve_nan():
+    z = random_values()
+    z[10, 20] = np.nan
+    for x_dev, y_dev, distr in [(4, 3, 'gaussian'), (6, 4, 'lorentzian')]:
+        kernel = filters.create_kernel(x_dev, y_dev, 7, distr)
+        expected = ndimage.convolve(z, kernel)
+        result = filters.convolve(z, x_dev, y_dev, 7, distr)
+        npt.assert_array_equal(np.isnan(result), np.isnan(expected))
+        npt.assert_allclose(result, expected, rtol=1e-10, atol=1e-12)
+
+
+def test_convolve_ignore_nan():
+    z = random_values()
+    z[10, 20] = z[30, 5:9] = np.nan
+    valid = ~np.isnan(z)
+    for x_dev, y_dev, distr in [(0.5, 0.5, 'gaussian'), (4, 3, 'gaussian'), (6, 4, 'lorentzian')]:
+        kernel = filters.create_kernel(x_dev, y_dev, 7, distr)
+        # Average of the valid values under the kernel
+        expected = (ndimage.convolve(np.where(valid, z, 0), kernel) /
+                    ndimage.convolve(valid.astype(float), kernel))
+        expected[~valid] = np.nan
+        result = filters.convolve(z, x_dev, y_dev, 7, distr, ignore_nan=True)
+        npt.assert_allclose(result, expected, rtol=1e-8, atol=1e-12)
+
+
+def test_kernel_cache(monkeypatch):
+    monkeypatch.setattr(filters, '_kernels', filters.MemoryCache(8e-3))# 8 kB, room for one kernel
+    kernel, separated = filters.get_kernel(4, 3, 7, 'gaussian')
+    assert separated is not None
+    assert filters.get_kernel(4, 3, 7, 'gaussian')[0] is kernel
+    assert filters._kernels.nbytes == kernel.nbytes + sum(a.nbytes for a in separated)
+
+    # Another kernel evicts the least recently used one
+    filters.get_kernel(3, 4, 7, 'gaussian')
+    assert filters.get_kernel(4, 3, 7, 'gaussian')[0] is not kernel
+    assert filters._kernels.nbytes <= 8000
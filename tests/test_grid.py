@@ -0,0 +1,41 @@
+import numpy as np
+import numpy.testing as npt
+
+from qtplot.data import Data2D
+
+
+def make_data(x, y, z=None):
+    x, y = np.meshgrid(x, y)
+    if z is None:
+        z = 2 * x - 3 * y + 1
+    return Data2D(x, y, z, np.zeros(x.shape))
+
+
+def test_find_grid():
+    data = make_data(np.linspace(0, 1, 11), np.linspace(-1, 1, 5))
+    # Noise within the tolerance and the NaN rows of an unfinished scan
+    data.x = data.x + 0.003 * np.random.RandomState(0).randn(*data.x.shape)
+    data.x[3:], data.y[3:] = np.nan, np.nan
+
+    x, y, rows, columns = data.get_grid()
+    assert (rows, columns) == (slice(0, 3), slice(0, 11))
+    npt.assert_allclose(x, np.linspace(0, 1, 11), atol=0.01)
+    npt.assert_array_equal(y, [-1, -0.5, 0])
+
+
+def test_find_grid_not_rectilinear():
+    warped = make_data(np.linspace(0, 1, 11), np.linspace(-1, 1, 5))
+    warped.x = warped.x + 0.2 * warped.y
+    assert warped.get_grid() is None
+
+
+def test_interpolate_grid():
+    data = make_data(np.linspace(0, 1, 11) ** 2, np.linspace(-1, 1, 5))
+    data.x = data.x + 0.0005 * data.y
+    points = np.array([[0.5, 0.2], [0.01, -1], [1, 1], [1.5, 0], [0.5, -1.2]])
+
+    # A plane is interpolated exactly, points outside the grid are NaN
+    values = data.interpolate_grid(points, data.get_grid())
+    npt.assert_allclose(values[:3], 2 * points[:3, 0] - 3 * points[:3, 1] + 1, rtol=1e-12)
+    assert np.isnan(values[3:]).all()
+    npt.assert_array_equal(data.interpolate(points), values)
@@ -0,0 +1,114 @@
+import functools
+
+import numpy as np
+import numpy.testing as npt
+
+from qtplot.cache import MemoryCache
+from qtplot.data import Data2D
+from qtplot.operations import Operations
+
+equal = npt.assert_array_equal
+
+
+class Op:
+    """ The attributes of an Operation which are used by run_queue """
+    def __init__(self, func, calls=None):
+        self.name = func.__name__
+        self.func = func
+        self.para_names = ()
+        if calls is not None:
+            @functools.wraps(func)
+            def counted(*args, **kwargs):
+                calls.append(self.name)
+                return func(*args, **kwargs)
+            self.func = counted
+
+
+def make_operations(cache_size=100):
+    # run_queue doesn't use the widgets
+    operations = Operations.__new__(Operations)
+    operations.stage_cache = MemoryCache(cache_size)
+    operations.stage_dat_file = None
+    return operations
+
+
+def make_data(dtype=np.float64):
+    x, y = np.meshgrid(np.linspace(1, 2, 40), np.linspace(3, 5, 30))
+    z = np.random.RandomState(0).randn(30, 40).astype(dtype)
+    z[::7, ::3] = np.nan
+    return Data2D(x, y, z, np.zeros((30, 40)))
+
+
+def test_stage_cache():
+    calls = []
+    operations = make_operations()
+    data = make_data()
+    queue = [(Op(Data2D.flip, calls), {'x_flip': True, 'y_flip': False}),
+             (Op(Data2D.lowpass, calls), {'x_width': 3, 'y_height': 3, 'method': 'gaussian'})]
+
+    result, _, _ = operations.run_queue(data, queue, None, 'key')
+    assert calls == ['flip', 'lowpass']
+
+    again, _, _ = operations.run_queue(data, queue, None, 'key')
+    assert calls == ['flip', 'lowpass']
+    assert again is not result
+    for name in ('x', 'y', 'z', 'row_numbers'):
+        equal(getattr(again, name), getattr(result, name))
+
+    # Modifying the result doesn't change the cached one
+    again.z_name = 'changed'
+    again.own('z')
+    again.z[:] = 0
+    third, _, _ = operations.run_queue(data, queue, None, 'key')
+    equal(third.z, result.z)
+    assert third.z_name == result.z_name
+
+    # Only the operations after a changed one are computed again
+    queue[1] = (queue[1][0], {'x_width': 5, 'y_height': 5, 'method': 'gaussian'})
+    changed, _, _ = operations.run_queue(data, queue, None, 'key')
+    assert calls == ['flip', 'lowpass', 'lowpass']
+
+    expected = data.copy()
+    expected.flip(x_flip=True, y_flip=False)
+    expected.lowpass(x_width=5, y_height=5, method='gaussian')
+    equal(changed.z, expected.z)
+
+
+def test_elementwise_fusion():
+    queue = [(Data2D.scale, {'x_scale': 2., 'y_scale': 1., 'z_scale': 3.}),
+             (Data2D.offset, {'x_offset': 0., 'y_offset': 1.5, 'z_offset': 0.25}),
+             (Data2D.abs, {}),
+             (Data2D.sub_min, {'x': True, 'y': False, 'z': True}),
+             (Data2D.log, {'x': False, 'y': True, 'z': True}),
+             (Data2D.negate, {})]
+
+    for dtype in (np.float64, np.float32):
+        operations = make_operations()
+        data = make_data(dtype)
+        z = data.z.copy()
+
+        result, _, _ = operations.run_queue(data, [(Op(f), k) for f, k in queue], None, 'key')
+
+        expected = data.copy()
+        for func, kwargs in queue:
+            func(expected, **kwargs)
+        for name in 'xyz':
+            equal(getattr(result, name), getattr(expected, name))
+        assert result.z.dtype == dtype
+        # The input is not modified, only the result of the run is cached
+        equal(data.z, z)
+        assert len(operations.stage_cache.items) == 1
+
+
+def test_precision():
+    # The values keep the precision of the profile after operations returning float64
+    operations = make_operations()
+    data = make_data(np.float32)
+    queue = [(Op(Data2D.interp_x), {'points': 20}),
+             (Op(Data2D.lowpass), {'x_width': 3, 'y_height': 3, 'method': 'gaussian',
+                                   'ignore_nan': True})]
+
+    result, _, _ = operations.run_queue(data, queue, None, 'key')
+    assert result.z.dtype == np.float32
+    assert result.x.dtype == np.float64
+    assert result.z.shape == (30, 20) and not np.isnan(result.z).all()
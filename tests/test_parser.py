@@ -0,0 +1,92 @@
+import os
+
+import numpy as np
+import numpy.testing as npt
+
+from qtplot import parser
+from qtplot.cache import ParseCache
+
+
+def write_lines(path, lines, newline='\n'):
+    with open(str(path), 'wb') as f:
+        f.write(newline.join(lines).encode('ascii') + newline.encode('ascii'))
+    return str(path)
+
+
+def parse_both(filename, usecols=None):
+    """ parse_parallel in small chunks and read_chunk on the whole file """
+    size = os.path.getsize(filename)
+    with open(filename, 'rb') as f:
+        expected = parser.read_chunk(f, 0, size, usecols)
+    result = parser.parse_parallel(filename, 0, size, usecols, workers=2)
+    return result, expected
+
+
+def assert_identical(result, expected):
+    assert result.dtype == expected.dtype
+    npt.assert_array_equal(result, expected)
+
+
+def test_parse_parallel(tmpdir, monkeypatch):
+    monkeypatch.setattr(parser, 'CHUNK_SIZE', 40)
+    rows = ['%d\t%d\t%d' % (i, 2 * i, -i) for i in range(50)]
+    lines = ['# comment', ''] + rows[:20] + [''] + rows[20:]
+
+    for newline in ('\n', '\r\n'):
+        filename = write_lines(tmpdir.join('a.dat'), lines, newline)
+        assert_identical(*parse_both(filename))
+        assert_identical(*parse_both(filename, [2, 0]))
+    # All integer
+    assert parse_both(filename)[0].dtype.kind == 'i'
+
+
+def test_parse_parallel_float_nan(tmpdir, monkeypatch):
+    monkeypatch.setattr(parser, 'CHUNK_SIZE', 40)
+    rows = ['%d\t%d\t%d' % (i, 2 * i, -i) for i in range(50)]
+    # Floats in one chunk only, NaN and trailing tabs (an empty last column)
+    rows[45] = '45\t0.1\t-1e-3'
+    rows[30] = '30\tnan\t'
+    lines = [row + '\t' for row in rows]
+
+    filename = write_lines(tmpdir.join('a.dat'), lines, '\r\n')
+    result, expected = parse_both(filename)
+    assert_identical(result, expected)
+    assert result.shape == (50, 4) and np.isnan(result[:, 3]).all()
+    assert_identical(*parse_both(filename, [1, 2]))
+
+
+def test_parse_cache(tmpdir, monkeypatch):
+    monkeypatch.setattr(ParseCache, 'MIN_FILE_SIZE', 0)
+    monkeypatch.setattr(ParseCache, 'MIN_FILE_AGE', 0)
+    cache = ParseCache(str(tmpdir.join('cache')), max_size=1)
+    filename = write_lines(tmpdir.join('a.dat'), ['1\t2', '3\t4'])
+    data = np.array([[1., 2.], [3., 4.]])
+
+    cache.put(filename, data, 8, [0, 1])
+    cached, parsed_bytes, columns = cache.get(filename)
+    npt.assert_array_equal(cached, data)
+    assert (parsed_bytes, columns) == (8, [0, 1])
+    del cached
+
+    # A new mtime or size misses the cache
+    st = os.stat(filename)
+    os.utime(filename, (st.st_atime, st.st_mtime + 10))
+    assert cache.get(filename) is None
+    write_lines(filename, ['1\t2', '3\t4', '5\t6'])
+    assert cache.get(filename) is None
+
+
+def test_parse_cache_size(tmpdir, monkeypatch):
+    monkeypatch.setattr(ParseCache, 'MIN_FILE_SIZE', 0)
+    monkeypatch.setattr(ParseCache, 'MIN_FILE_AGE', 0)
+    # Room for one entry of 10000 values
+    cache = ParseCache(str(tmpdir.join('cache')), max_size=0.1)
+    data = np.zeros((5000, 2))
+    first = write_lines(tmpdir.join('a.dat'), ['1'])
+    second = write_lines(tmpdir.join('b.dat'), ['2'])
+
+    cache.put(first, data, 2, [0, 1])
+    os.utime(os.path.join(cache.directory, cache.get_key(first)[0] + '.json'), (0, 0))
+    cache.put(second, data, 2, [0, 1])
+    assert cache.get(first) is None
+    assert cache.get(second) is not None
@@ -0,0 +1,72 @@
+import numpy as np
+import numpy.testing as npt
+from scipy.interpolate import interp1d
+
+from qtplot.util import get_next_filename, interp_rows
+
+
+def interp_loop(x, y, x_new):
+    return np.array([interp1d(x[i], y[i], bounds_error=False,
+                              fill_value=np.nan)(x_new)
+                     for i in range(len(x))])
+
+
+def random_rows(n=20, m=30, seed=0):
+    rs = np.random.RandomState(seed)
+    # Irregular spacing and a different range for every row
+    x = np.cumsum(rs.uniform(0.1, 1, (n, m)), axis=1) + rs.uniform(-2, 2, (n, 1))
+    y = rs.normal(size=(n, m))
+    x_new = np.linspace(-3, 30, 200)
+    return x, y, x_new
+
+
+def test_interp_rows():
+    x, y, x_new = random_rows()
+    npt.assert_allclose(interp_rows(x, y, x_new), interp_loop(x, y, x_new))
+
+    # Interpolate at the data points themselves
+    x_new = np.sort(x[0])
+    npt.assert_allclose(interp_rows(x, y, x_new), interp_loop(x, y, x_new))
+
+
+def test_interp_rows_decreasing():
+    x, y, x_new = random_rows()
+    x, y = x[:,::-1], y[:,::-1]
+    npt.assert_allclose(interp_rows(x, y, x_new), interp_loop(x, y, x_new))
+
+    # Decreasing and increasing rows mixed
+    x[::2], y[::2] = x[::2,::-1], y[::2,::-1]
+    npt.assert_allclose(interp_rows(x, y, x_new), interp_loop(x, y, x_new))
+
+
+def test_interp_rows_nan():
+    x, y, x_new = random_rows()
+    y[3, 10] = np.nan
+    y[5] = np.nan
+    npt.assert_allclose(interp_rows(x, y, x_new), interp_loop(x, y, x_new))
+
+
+def test_interp_rows_duplicates():
+    x, y, x_new = random_rows()
+    x[:, 10] = x[:, 11]
+    # Avoid x_new at the duplicates, where the slope is undefined
+    x_new = x_new[(np.abs(x_new[:,np.newaxis] - x[:, 10]) > 1e-9).all(axis=1)]
+    npt.assert_allclose(interp_rows(x, y, x_new), interp_loop(x, y, x_new))
+
+
+def test_interp_rows_dtype():
+    x, y, x_new = random_rows()
+    y = np.round(y * 100).astype(int)
+    npt.assert_allclose(interp_rows(x, y, x_new), interp_loop(x, y, x_new))
+    y = y.astype(np.float32)
+    npt.assert_allclose(interp_rows(x, y, x_new), interp_loop(x, y, x_new),
+                        rtol=1e-6)
+
+
+def test_get_next_filename():
+    assert get_next_filename('dev8_930.dat') == 'dev8_931.dat'
+    assert get_next_filename('dev8_930.dat', -2) == 'dev8_928.dat'
+    assert get_next_filename('/data/run9.dat', 1) == '/data/run10.dat'
+    assert get_next_filename('930.dat') == '931.dat'
+    assert get_next_filename('dev_a.dat') is None
+    assert get_next_filename('dev8_930.mtx') is None